@@ -0,0 +1,209 @@
+// Draw the diagram embedded by `form_svg.py -C` on a canvas covering the window.
+// Only what is inside the window is drawn, at most once per animation frame.
+(() => {
+  const data = JSON.parse(document.getElementById('diagram').textContent);
+  const P = data.padding;
+  const TEN_MINUTE_GAP = Math.round(60 * 10 * data.secondGap);
+  const BUCKET_WIDTH = 6 * TEN_MINUTE_GAP; // one hour
+  const HOVER_DISTANCE = 4;
+
+  // Same colors as style.css
+  const COLORS = {
+    hour: ['black', 'black'],
+    min30: ['darkblue', 'grey'],
+    min10: ['slateblue', 'lightgrey'],
+    station: ['black', 'black'],
+    noserv_station: ['grey', 'grey'],
+    taroko: 'hsl(300, 0%, 65%)',
+    puyuma: 'red',
+    tze_chiang: 'hsl(14, 44%, 79%)',
+    tze_chiang_diesel: 'hsl(30, 100%, 70%)',
+    emu1200: 'hsl(327, 100%, 80%)',
+    emu300: 'hsl(0, 73%, 100%)',
+    chu_kuang: 'hsl(48, 100%, 80%)',
+    local: 'hsl(240, 100%, 80%)',
+    fu_hsing: 'hsl(220, 49%, 86%)',
+    ordinary: 'black',
+    special: 'hsl(120, 70%, 100%)',
+    added: 'hsl(120, 70%, 40%)',
+    removed: 'hsl(0, 80%, 50%)',
+    shifted: 'hsl(220, 90%, 50%)',
+    shifted_from: 'hsl(220, 30%, 75%)',
+  };
+  const DASHED = new Set(['emu1200', 'emu300', 'removed', 'shifted_from']);
+
+  // Decode delta-encoded segments into pixel coordinates, with bounding boxes
+  const segments = [];
+  data.trains.forEach(([code, klass, encoded]) => encoded.forEach((deltas) => {
+    const points = new Float32Array(deltas.length);
+    let x = 0;
+    let y = 0;
+    for (let i = 0; i < deltas.length; i += 2) {
+      x += deltas[i];
+      y += deltas[i + 1];
+      points[i] = P + x * data.secondGap;
+      points[i + 1] = P + y;
+    }
+    const xs = points.filter((_, i) => i % 2 === 0);
+    const ys = points.filter((_, i) => i % 2 === 1);
+    segments.push({
+      code, klass, points,
+      left: Math.min(...xs), right: Math.max(...xs),
+      top: Math.min(...ys), bottom: Math.max(...ys),
+    });
+  }));
+
+  // Segments by the hour columns they cross, for culling and hover lookup
+  const buckets = [];
+  segments.forEach((s) => {
+    for (let b = Math.floor(s.left / BUCKET_WIDTH); b <= Math.floor(s.right / BUCKET_WIDTH); b++) {
+      (buckets[b] = buckets[b] || []).push(s);
+    }
+  });
+  const segmentsIn = (left, right, top, bottom) => {
+    const found = new Set();
+    for (let b = Math.max(0, Math.floor(left / BUCKET_WIDTH)); b <= Math.floor(right / BUCKET_WIDTH); b++) {
+      (buckets[b] || []).forEach((s) => {
+        if (s.right >= left && s.left <= right && s.bottom >= top && s.top <= bottom) {
+          found.add(s);
+        }
+      });
+    }
+    return found;
+  };
+
+  const minType = (i) => (i % 6 === 0 ? 'hour' : i % 3 === 0 ? 'min30' : 'min10');
+
+  document.body.style.margin = '0';
+  const spacer = document.createElement('div');
+  spacer.style.width = `${data.width}px`;
+  spacer.style.height = `${data.height}px`;
+  const canvas = document.createElement('canvas');
+  canvas.style.position = 'fixed';
+  canvas.style.left = '0';
+  canvas.style.top = '0';
+  document.body.append(spacer, canvas);
+  const ctx = canvas.getContext('2d');
+
+  let hovered = null;
+
+  const draw = () => {
+    const ratio = window.devicePixelRatio || 1;
+    const viewWidth = document.documentElement.clientWidth;
+    const viewHeight = document.documentElement.clientHeight;
+    if (canvas.width !== viewWidth * ratio || canvas.height !== viewHeight * ratio) {
+      canvas.width = viewWidth * ratio;
+      canvas.height = viewHeight * ratio;
+      canvas.style.width = `${viewWidth}px`;
+      canvas.style.height = `${viewHeight}px`;
+    }
+    const left = window.scrollX;
+    const top = window.scrollY;
+    const right = left + viewWidth;
+    const bottom = top + viewHeight;
+
+    ctx.setTransform(ratio, 0, 0, ratio, 0, 0);
+    ctx.fillStyle = 'white';
+    ctx.fillRect(0, 0, viewWidth, viewHeight);
+    ctx.setTransform(ratio, 0, 0, ratio, -left * ratio, -top * ratio);
+
+    // Grid
+    ctx.lineWidth = 0.3;
+    const lastTenMinute = data.hourCount * 6;
+    const firstVisible = Math.max(0, Math.floor((left - P) / TEN_MINUTE_GAP));
+    const lastVisible = Math.min(lastTenMinute, Math.ceil((right - P) / TEN_MINUTE_GAP));
+    for (let m = firstVisible; m <= lastVisible; m++) {
+      const x = P + m * TEN_MINUTE_GAP;
+      ctx.strokeStyle = COLORS[minType(data.startHour * 6 + m)][0];
+      ctx.beginPath();
+      ctx.moveTo(x, P);
+      ctx.lineTo(x, data.height - P);
+      ctx.stroke();
+    }
+    data.stations.forEach(([, y, active]) => {
+      if (P + y < top || P + y > bottom) return;
+      ctx.strokeStyle = COLORS[active ? 'station' : 'noserv_station'][0];
+      ctx.beginPath();
+      ctx.moveTo(P, P + y);
+      ctx.lineTo(data.width - 3 * P, P + y);
+      ctx.stroke();
+    });
+
+    // Trains
+    ctx.font = '12px sans-serif';
+    segmentsIn(left, right, top, bottom).forEach((s) => {
+      const color = COLORS[s.klass] || 'black';
+      ctx.strokeStyle = color;
+      ctx.lineWidth = s.code === hovered ? 5 : 2;
+      ctx.setLineDash(DASHED.has(s.klass) ? [25, 5] : []);
+      ctx.beginPath();
+      ctx.moveTo(s.points[0], s.points[1]);
+      for (let i = 2; i < s.points.length; i += 2) {
+        ctx.lineTo(s.points[i], s.points[i + 1]);
+      }
+      ctx.stroke();
+      if (s.code !== hovered) {
+        ctx.fillStyle = color;
+        ctx.fillText(s.code, s.points[0] + 2, s.points[1] - 2);
+      }
+    });
+    ctx.setLineDash([]);
+
+    // Sticky axes, drawn in window coordinates
+    ctx.setTransform(ratio, 0, 0, ratio, 0, 0);
+    for (let m = firstVisible; m <= lastVisible; m++) {
+      const i = data.startHour * 6 + m;
+      ctx.fillStyle = COLORS[minType(i)][1];
+      const label = `${String(Math.floor(i / 6)).padStart(2, '0')}${i % 6}0`;
+      ctx.fillText(label, P + m * TEN_MINUTE_GAP - left, Math.max(P - 1 - top, 30));
+    }
+    data.stations.forEach(([name, y, active]) => {
+      if (P + y < top || P + y > bottom) return;
+      ctx.fillStyle = COLORS[active ? 'station' : 'noserv_station'][1];
+      ctx.fillText(name, 0, P + y - 5 - top);
+    });
+  };
+
+  let scheduled = false;
+  const schedule = () => {
+    if (scheduled) return;
+    scheduled = true;
+    window.requestAnimationFrame(() => {
+      scheduled = false;
+      draw();
+    });
+  };
+
+  const distanceToLine = (px, py, x1, y1, x2, y2) => {
+    const dx = x2 - x1;
+    const dy = y2 - y1;
+    const length = dx * dx + dy * dy;
+    const t = length ? Math.max(0, Math.min(1, ((px - x1) * dx + (py - y1) * dy) / length)) : 0;
+    return Math.hypot(px - x1 - t * dx, py - y1 - t * dy);
+  };
+
+  canvas.addEventListener('mousemove', (event) => {
+    const x = event.clientX + window.scrollX;
+    const y = event.clientY + window.scrollY;
+    let nearest = null;
+    let nearestDistance = HOVER_DISTANCE;
+    segmentsIn(x - HOVER_DISTANCE, x + HOVER_DISTANCE, y - HOVER_DISTANCE, y + HOVER_DISTANCE).forEach((s) => {
+      for (let i = 2; i < s.points.length; i += 2) {
+        const d = distanceToLine(x, y, s.points[i - 2], s.points[i - 1], s.points[i], s.points[i + 1]);
+        if (d <= nearestDistance) {
+          nearest = s.code;
+          nearestDistance = d;
+        }
+      }
+    });
+    if (nearest !== hovered) {
+      hovered = nearest;
+      canvas.title = nearest || '';
+      schedule();
+    }
+  });
+
+  window.addEventListener('scroll', schedule, { passive: true });
+  window.addEventListener('resize', schedule);
+  draw();
+})();
@@ -1,10 +1,20 @@
-window.addEventListener('scroll', () => {
-  Array.prototype.map.call(
-    document.querySelectorAll('g.station > text'),
-    (e) => e.setAttribute('x', window.pageXOffset)
-  );
-  Array.prototype.map.call(
-    document.querySelectorAll('g.hour > text'),
-    (e) => e.setAttribute('y', window.pageYOffset + 30)
-  );
-})
+// Keep the time axis at the top and the station axis at the left while scrolling.
+// Both are fixed-position overlays, only moved by a transform once per animation frame.
+(() => {
+  const timeAxis = document.querySelector('svg.time_axis');
+  const stationAxis = document.querySelector('svg.station_axis');
+  let scheduled = false;
+
+  const update = () => {
+    scheduled = false;
+    timeAxis.style.transform = `translateX(${-window.scrollX}px)`;
+    stationAxis.style.transform = `translateY(${-window.scrollY}px)`;
+  };
+
+  window.addEventListener('scroll', () => {
+    if (scheduled) return;
+    scheduled = true;
+    window.requestAnimationFrame(update);
+  }, { passive: true });
+  update();
+})();
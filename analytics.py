@@ -0,0 +1,200 @@
+'''
+Headway, section occupancy, and dwell time of every route
+
+All numbers come from the legs of `segment_index`, so the timetable is
+scanned only once for the whole network. Each metric sorts the times of a
+station or a section once, then works on the sorted lists. NumPy is not a
+dependency of this project, so these are plain Python lists and loops
+rather than array kernels.
+
+Stations are given by code as well as by name, as a name may be empty or shared.
+
+Times are in seconds.
+'''
+from __future__ import annotations
+
+import csv
+import json
+import statistics
+from bisect import bisect_left, bisect_right
+from collections import Counter, namedtuple
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from segment_index import RouteIndex, build_index, time_in_range
+
+if TYPE_CHECKING:
+    import argparse
+
+HeadwayRow = namedtuple('HeadwayRow', [
+    'route', 'station_code', 'station', 'direction', 'trains', 'min_headway', 'mean_headway'])
+SectionRow = namedtuple('SectionRow', [
+    'route', 'from_station_code', 'from_station', 'to_station_code', 'to_station',
+    'trains', 'peak_hour', 'peak_trains_per_hour'])
+DwellRow = namedtuple('DwellRow', [
+    'route', 'station_code', 'station', 'stops', 'min', 'median', 'mean', 'p90', 'max'])
+
+
+def direction(y0: float, y1: float) -> str:
+    return 'ascending' if y1 > y0 else 'descending'
+
+
+def stations_by_distance(route_index: RouteIndex) -> dict[float, tuple[str, str]]:
+    '''
+    Distance -> (code, name) of the station there
+    '''
+    geometry = route_index.geometry
+    return dict(zip(geometry.distances, zip(geometry.codes, geometry.names)))
+
+
+def train_spans(index: dict[str, RouteIndex]) -> dict[str, tuple[int, int]]:
+    '''
+    Train code -> times of its first and last stop, on any route
+    '''
+    spans = {}
+    for route_index in index.values():
+        for leg in route_index.legs:
+            first, last = spans.get(leg.code, (leg.t0, leg.t1))
+            spans[leg.code] = (min(first, leg.t0), max(last, leg.t1))
+    return spans
+
+
+def compute_headways(route_name: str, route_index: RouteIndex) -> list[HeadwayRow]:
+    '''
+    Time between consecutive departures from each station in each direction
+    '''
+    stations = stations_by_distance(route_index)
+    departures = {}
+    for leg in route_index.legs:
+        if leg.y0 != leg.y1:
+            departures.setdefault((leg.y0, direction(leg.y0, leg.y1)), []).append(leg.t0)
+    rows = []
+    for (y, direction_), times in sorted(departures.items()):
+        times.sort()
+        headways = [b - a for a, b in zip(times, times[1:])]
+        rows.append(HeadwayRow(
+            route=route_name, station_code=stations[y][0], station=stations[y][1], direction=direction_,
+            trains=len(times),
+            min_headway=min(headways, default=None),
+            mean_headway=round(statistics.fmean(headways)) if headways else None,
+        ))
+    return rows
+
+
+def compute_section_peaks(route_name: str, route_index: RouteIndex) -> list[SectionRow]:
+    '''
+    Trains entering each section between adjacent stations, and its busiest hour
+    '''
+    # Every station bounds a section, even one without a name or sharing a name
+    geometry = route_index.geometry
+    distances, codes, names = geometry.distances, geometry.codes, geometry.names
+    enter_times = {i: [] for i in range(len(distances) - 1)}
+    for leg in route_index.legs:
+        if leg.y0 == leg.y1:
+            continue
+        low, high = min(leg.y0, leg.y1), max(leg.y0, leg.y1)
+        # A leg between two stops passes every section in between
+        for i in range(bisect_left(distances, low), bisect_right(distances, high) - 1):
+            span = time_in_range(leg, distances[i], distances[i + 1])
+            if span is not None:
+                enter_times[i].append(span[0])
+    rows = []
+    for i, times in enter_times.items():
+        per_hour = Counter(int(t // 3600) for t in times)
+        peak_hour, peak = max(sorted(per_hour.items()), key=lambda x: x[1], default=(None, 0))
+        rows.append(SectionRow(
+            route=route_name,
+            from_station_code=codes[i], from_station=names[i],
+            to_station_code=codes[i + 1], to_station=names[i + 1],
+            trains=len(times),
+            peak_hour=None if peak_hour is None else f'{peak_hour:0>2d}:00',
+            peak_trains_per_hour=peak,
+        ))
+    return rows
+
+
+def compute_dwells(route_name: str, route_index: RouteIndex,
+                   spans: dict[str, tuple[int, int]]) -> list[DwellRow]:
+    '''
+    Distribution of the time trains stay at each station.
+    The first and last stop of a train, from `train_spans`, are not stays
+    '''
+    stations = stations_by_distance(route_index)
+    dwells = {}
+    for leg in route_index.legs:
+        if leg.y0 == leg.y1 and leg.t0 != spans[leg.code][0] and leg.t1 != spans[leg.code][1]:
+            dwells.setdefault(leg.y0, []).append(leg.t1 - leg.t0)
+    rows = []
+    for y, times in sorted(dwells.items()):
+        times.sort()
+        rows.append(DwellRow(
+            route=route_name, station_code=stations[y][0], station=stations[y][1], stops=len(times),
+            min=times[0], median=statistics.median(times),
+            mean=round(statistics.fmean(times)),
+            p90=times[min(len(times) - 1, int(len(times) * 0.9))],
+            max=times[-1],
+        ))
+    return rows
+
+
+def compute_all(index: dict[str, RouteIndex]) -> dict[str, list[tuple]]:
+    result = {'headway': [], 'section': [], 'dwell': []}
+    spans = train_spans(index)
+    for route_name, route_index in sorted(index.items()):
+        result['headway'].extend(compute_headways(route_name, route_index))
+        result['section'].extend(compute_section_peaks(route_name, route_index))
+        result['dwell'].extend(compute_dwells(route_name, route_index, spans))
+    return result
+
+
+def save_csv(result: dict[str, list[tuple]], output_folder: Path):
+    for name, rows in result.items():
+        with (output_folder / f'{name}.csv').open('w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(rows[0]._fields if rows else ())
+            writer.writerows(rows)
+
+
+def save_json(result: dict[str, list[tuple]], output_folder: Path):
+    dumped_json = json.dumps(
+        {name: [row._asdict() for row in rows] for name, rows in result.items()},
+        indent=4, ensure_ascii=False)
+    (output_folder / 'analytics.json').write_text(dumped_json, encoding='utf-8')
+
+
+def get_arg_parser() -> argparse.ArgumentParser:
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Compute headway, section occupancy, and dwell time of every route',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        '-d',
+        type=str, dest='db', default='db.sqlite',
+        help='Input database file name')
+    parser.add_argument(
+        '-O',
+        default=Path('OUTPUT'), type=Path, dest='output_folder',
+        help='Output folder')
+    parser.add_argument(
+        '-f',
+        default='csv', choices=('csv', 'json'), dest='format',
+        help='Output format. CSV is saved as one file for each metric')
+    return parser
+
+
+if __name__ == '__main__':
+    from db import READ, setup_sqlite
+    from geometry import load_geometries
+
+    parser = get_arg_parser()
+    args = parser.parse_args()
+
+    con = setup_sqlite(args.db, profile=READ)
+    with con:
+        index = build_index(con, geometries=load_geometries(con, args.db))
+    result = compute_all(index)
+    if args.format == 'csv':
+        save_csv(result, args.output_folder)
+    else:
+        save_json(result, args.output_folder)
@@ -0,0 +1,120 @@
+'''
+Benchmarks for the scripts
+
+Each subcommand prints what it measured and exits with 1 when over budget.
+'''
+from __future__ import annotations
+
+import argparse
+import subprocess
+import sys
+import tempfile
+from collections import namedtuple
+from pathlib import Path
+
+ImportTime = namedtuple('ImportTime', ['self_us', 'cumulative_us', 'module'])
+
+# Only needed when loading JSON, never when drawing from a prepared database
+HEAVY_MODULES = ('pypika', 'construct_db_from_json')
+
+
+# Draws every route of a prepared database to a temporary folder in a fresh interpreter,
+# as `form_svg.py -N -d` does. Geometries are built, not loaded, so nothing is saved next to the database
+RENDER = '''
+import sys, tempfile, time
+from contextlib import redirect_stdout
+from io import StringIO
+started = time.perf_counter()
+from form_svg import network_layout, save_route, scan_network
+from db import READ, setup_sqlite
+from geometry import build_geometries
+con = setup_sqlite(sys.argv[1], profile=READ)
+with con, tempfile.TemporaryDirectory() as folder, redirect_stdout(StringIO()):
+    geometries = build_geometries(con)
+    network = scan_network(con, given_train_codes=None)
+    for route in sorted(network):
+        save_route(folder, route, geometry=geometries[route], layout=network_layout(network.pop(route), geometries[route]))
+print(time.perf_counter() - started)
+print(*sorted(sys.modules))
+'''
+
+
+def prepare_db(folder: Path, input_folder: Path) -> str:
+    from golden import build_db
+
+    db_location = str(folder / 'db.sqlite')
+    build_db(db_location, input_folder)
+    return db_location
+
+
+def measure_render(db_location: str) -> tuple[list[ImportTime], float, list[str]]:
+    '''
+    Import times, seconds from the first import until drawn, and every module loaded by then
+    '''
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', RENDER, db_location],
+        capture_output=True, text=True, check=True, cwd=Path(__file__).parent)
+    import_times = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        import_times.append(ImportTime(self_us=int(self_us), cumulative_us=int(cumulative_us), module=name.strip()))
+    seconds, modules = completed.stdout.splitlines()
+    return import_times, float(seconds), modules.split()
+
+
+def check_render_time(db_location: str, budget_ms: float, repeat: int) -> bool:
+    # The first run may compile bytecode, so take the best of several runs
+    runs = [measure_render(db_location) for _ in range(repeat)]
+    best_import = min(
+        next(t.cumulative_us for t in import_times if t.module == 'form_svg')
+        for import_times, _, _ in runs
+    ) / 1000
+    best = min(seconds for _, seconds, _ in runs) * 1000
+    heavy = sorted({name.split('.')[0] for name in runs[-1][2]} & set(HEAVY_MODULES))
+    print(f'import form_svg: {best_import:.1f} ms')
+    print(f'import and draw every route: {best:.1f} ms (budget {budget_ms} ms)')
+    for name in heavy:
+        print(f'  imports heavy module "{name}"')
+    return best <= budget_ms and not heavy
+
+
+def get_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description='Benchmarks for the scripts',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    importtime = subparsers.add_parser(
+        'importtime',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        help='Check the cost of drawing from a prepared database in a fresh interpreter')
+    importtime.add_argument(
+        '-d',
+        default=None, type=str, dest='db',
+        help='Prepared database to draw. A database of the JSON files in -I is built if not given')
+    importtime.add_argument(
+        '-I',
+        default='GOLDEN/JSON', type=str, dest='input_folder',
+        help='Folder of route.json, station.json, and timetable.json')
+    importtime.add_argument(
+        '-b',
+        default=100, type=float, dest='budget',
+        help='Budget for importing and drawing in milliseconds')
+    importtime.add_argument(
+        '-n',
+        default=5, type=int, dest='repeat',
+        help='Number of runs')
+    return parser
+
+
+if __name__ == '__main__':
+    parser = get_arg_parser()
+    args = parser.parse_args()
+
+    if args.command == 'importtime':
+        with tempfile.TemporaryDirectory() as folder:
+            db_location = args.db or prepare_db(Path(folder), Path(args.input_folder))
+            ok = check_render_time(db_location, args.budget, args.repeat)
+    sys.exit(0 if ok else 1)
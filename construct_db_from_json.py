@@ -11,9 +11,8 @@ from operator import itemgetter
 from pathlib import Path
 from typing import Callable, Generator, Union
 
-from pypika import Parameter
-from pypika import PostgreSQLQuery as Query  # Only this supports 'RETURING'
-from pypika import Table
+import statements
+from db import LOAD, setup_sqlite
 
 CAR_CLASS = {  # copy from developer manual in timetable webpage
     '1101': '自強(太,障)',
@@ -83,98 +82,14 @@ def print_(s: str):
 
 
 def create_schema(con: sqlite3.Connection):
-    cur = con.cursor()
-
-    tables =\
-        (
-            station_table,
-            station_name_cht_table,
-            route_table,
-            route_station_table,
-            train_type_table,
-            train_type_name_cht_table,
-            train_table,
-            timetable_table,
-        ) =\
-        (
-            Query.create_table('station'),
-            Query.create_table('station_name_cht'),
-            Query.create_table('route'),
-            Query.create_table('route_station'),
-            Query.create_table('train_type'),
-            Query.create_table('train_type_name_cht'),
-            Query.create_table('train'),
-            Query.create_table('timetable')
-        )
-
-    station_table.columns(
-        ('pk', 'INTEGER PRIMARY KEY AUTOINCREMENT'),
-        ('code', 'TEXT UNIQUE NOT NULL'),
-        ('is_active', 'INTEGER DEFAULT 0 NOT NULL')
-    )
-
-    station_name_cht_table.columns(
-        ('pk', 'INTEGER PRIMARY KEY AUTOINCREMENT'),
-        ('station_fk', 'REFERENCES station ON DELETE CASCADE'),
-        ('name', 'TEXT NOT NULL')
-    )
-
-    route_table.columns(
-        ('pk', 'INTEGER PRIMARY KEY AUTOINCREMENT'),
-        ('name', 'TEXT NOT NULL UNIQUE'),
-    )
-
-    route_station_table.columns(
-        ('pk', 'INTEGER PRIMARY KEY AUTOINCREMENT'),
-        ('route_fk', 'REFERENCES route ON DELETE CASCADE'),
-        ('station_fk', 'REFERENCES station ON DELETE CASCADE'),
-        ('relative_distance', 'REAL NOT NULL'),
-    )
-
-    train_type_table.columns(
-        ('pk', 'INTEGER PRIMARY KEY AUTOINCREMENT'),
-        ('code', 'TEXT UNIQUE NOT NULL'),
-    )
-
-    train_type_name_cht_table.columns(
-        ('pk', 'INTEGER PRIMARY KEY AUTOINCREMENT'),
-        ('train_type_fk', 'REFERENCES train_type ON DELETE CASCADE'),
-        ('name', 'TEXT NOT NULL'),
-    )
-
-    train_table.columns(
-        ('pk', 'INTEGER PRIMARY KEY AUTOINCREMENT'),
-        ('train_type_fk', 'REFERENCES train_type ON DELETE CASCADE'),
-        ('code', 'TEXT NOT NULL'),
-    )
-
-    timetable_table.columns(
-        ('pk', 'INTEGER PRIMARY KEY AUTOINCREMENT'),
-        ('station_fk', 'REFERENCES train_type ON DELETE CASCADE'),
-        ('train_fk', 'REFERENCES train ON DELETE CASCADE'),
-        ('previous', 'REFERENCE timetable NULL'),
-        ('time', 't_time NOT NULL'),
-        ('order_', 'INTEGER NOT NULL'),
-    )
-
-    cur.executescript(
-        ';'.join(t.get_sql() for t in tables)
-    )
+    con.executescript(statements.create_schema())
 
 
 def fill_in_stations(cur: sqlite3.Cursor, station: Path):
     with station.open() as f:
         station_json = json.load(f)
-    insert_station_code = (
-        Query.into('station')
-        .columns('code').insert(Parameter('?'))
-        .returning('pk').get_sql())
-    insert_station_name = (
-        Query.into('station_name_cht')
-        .columns('station_fk', 'name')
-        .insert(Parameter(':pk'), Parameter(':name'))
-        .get_sql()
-    )
+    insert_station_code = statements.insert_station_code()
+    insert_station_name = statements.insert_station_name()
     for station in station_json:
         cur.execute(
             insert_station_code, (station['stationCode'],)
@@ -208,24 +123,12 @@ irregular_stations = {
 def fill_in_routes(cur: sqlite3.Cursor, route: Path):
     with route.open() as f:
         route_json = json.load(f)
-    station_table = Table('station')
-    insert_route_name = Query.into('route')\
-        .columns('name').insert(Parameter('?'))\
-        .returning('pk').get_sql()
-    select_station_pk = Query.from_(station_table)\
-        .select('pk').where(station_table.code == Parameter('?')).get_sql()
-    update_active_station = Query.update(station_table)\
-        .set('is_active', 1)\
-        .where(station_table.pk == Parameter('?')).get_sql()
-    insert_inactive_station = Query.into(station_table)\
-        .columns('code', 'is_active').insert(Parameter('?'), 0)\
-        .returning('pk').get_sql()
-    insert_station_name = Query.into('station_name_cht')\
-        .columns('station_fk', 'name').insert(Parameter(':pk'), Parameter(':name')).get_sql()
-    insert_relative_distance_on_route_of_a_station = Query.into('route_station')\
-        .columns('route_fk', 'station_fk', 'relative_distance')\
-        .insert(Parameter(':route_pk'), Parameter(':station_pk'), Parameter(':distance'))\
-        .get_sql()
+    insert_route_name = statements.insert_route_name()
+    select_station_pk = statements.select_station_pk()
+    update_active_station = statements.update_active_station()
+    insert_inactive_station = statements.insert_inactive_station()
+    insert_station_name = statements.insert_station_name()
+    insert_relative_distance_on_route_of_a_station = statements.insert_route_station()
     for route_name, routes in groupby(sorted(route_json, key=itemgetter('lineName')), key=itemgetter('lineName')):
         cur.execute(insert_route_name, (route_name,))
         route_pk = cur.fetchone()['pk']
@@ -263,12 +166,7 @@ Info = namedtuple('Info', ['order', 'key', 'time', 'station_pk'])
 
 
 def mutate_info(item: dict[str, str], cur: sqlite3.Cursor) -> Info:
-    station_table = Table('station')
-    cur.execute(
-        Query.from_(station_table)
-        .where(station_table.code == Parameter('?'))
-        .select('pk').get_sql(),
-        (item['Station'],))
+    cur.execute(statements.select_station_pk(), (item['Station'],))
     station_pk = cur.fetchone()['pk']
     for key in ('ARRTime', 'DEPTime'):
         yield Info(
@@ -309,13 +207,7 @@ def insert_(last_pk: Union[None, int], current: Info, cur: sqlite3.Cursor, train
     }
     if last_pk:
         input_['previous'] = last_pk
-    cur.execute(
-        Query.into('timetable')
-        .columns('station_fk', 'train_fk', 'time', 'previous', 'order_')
-        .insert(Parameter(':station_pk'), Parameter(':train_pk'),
-                Parameter(':time'), Parameter(':previous'), Parameter(':order'))
-        .returning('pk').get_sql(),
-        input_)
+    cur.execute(statements.insert_timetable(), input_)
     return cur.fetchone()['pk']
 
 
@@ -343,29 +235,24 @@ def get_over_night_station_order(station_code: Union[None, int], infos: list[dic
     return order
 
 
-def fill_in_timetable(cur: sqlite3.Cursor, timetable: Path):
-    with timetable.open() as f:
-        timetable_json = json.load(f)
-    insert_train_type = Query.into('train_type')\
-        .columns('code').insert(Parameter('?')).returning('pk').get_sql()
-    insert_train_type_name = Query.into('train_type_name_cht')\
-        .columns('train_type_fk', 'name')\
-        .insert(Parameter(':train_type_pk'), Parameter(':name')).get_sql()
-    connect_train_n_train_type = Query.into('train')\
-        .columns('train_type_fk', 'code')\
-        .insert(Parameter(':train_type_pk'), Parameter(':code'))\
-        .returning('pk').get_sql()
-    for train_type, trains in groupby(
-            sorted(timetable_json['TrainInfos'],
-                   key=itemgetter('CarClass')),
-            key=itemgetter('CarClass')):
-        cur.execute(insert_train_type, (train_type,))
-        train_type_pk = cur.fetchone()['pk']
-        cur.execute(
-            insert_train_type_name,
-            {'train_type_pk': train_type_pk, 'name': CAR_CLASS[train_type]}
-        )
-        for train in trains:
+def fill_in_trains(cur: sqlite3.Cursor, trains: list[dict]):
+    select_train_type_pk = statements.select_train_type_pk()
+    insert_train_type = statements.insert_train_type()
+    insert_train_type_name = statements.insert_train_type_name()
+    connect_train_n_train_type = statements.insert_train()
+    for train_type, trains_ in groupby(sorted(trains, key=itemgetter('CarClass')), key=itemgetter('CarClass')):
+        cur.execute(select_train_type_pk, (train_type,))
+        train_type_row = cur.fetchone()
+        if train_type_row:
+            train_type_pk = train_type_row['pk']
+        else:
+            cur.execute(insert_train_type, (train_type,))
+            train_type_pk = cur.fetchone()['pk']
+            cur.execute(
+                insert_train_type_name,
+                {'train_type_pk': train_type_pk, 'name': CAR_CLASS[train_type]}
+            )
+        for train in trains_:
             cur.execute(
                 connect_train_n_train_type,
                 {'train_type_pk': train_type_pk, 'code': train['Train']}
@@ -376,6 +263,21 @@ def fill_in_timetable(cur: sqlite3.Cursor, timetable: Path):
             insert_points_of_time(cur, train['TimeInfos'], over_night_station_order, train, train_pk, last_order)
 
 
+def fill_in_timetable(cur: sqlite3.Cursor, timetable: Path):
+    with timetable.open() as f:
+        timetable_json = json.load(f)
+    fill_in_trains(cur, timetable_json['TrainInfos'])
+
+
+def delete_trains(cur: sqlite3.Cursor, train_codes: list[str]):
+    '''
+    Trains with these codes, and all their stops
+    '''
+    if train_codes:
+        cur.execute(statements.delete_stops_of_trains(len(train_codes)), tuple(train_codes))
+        cur.execute(statements.delete_trains(len(train_codes)), tuple(train_codes))
+
+
 def load_data_from_json(con: sqlite3.Connection, route: Path,
                         station: Path, timetable: Path):
     cur = con.cursor()
@@ -388,22 +290,6 @@ def load_data_from_json(con: sqlite3.Connection, route: Path,
     fill_in_timetable(cur, timetable)
 
 
-def adapt_time(t: timedelta) -> int:
-    return round(t.total_seconds())
-
-
-def convert_time(digits: Union[int, bytes]) -> timedelta:
-    return timedelta(seconds=int(digits))
-
-
-def setup_sqlite(db_location: str) -> sqlite3.Connection:
-    sqlite3.register_adapter(timedelta, adapt_time)
-    sqlite3.register_converter('t_time', convert_time)
-    con = sqlite3.connect(db_location, detect_types=sqlite3.PARSE_DECLTYPES)
-    con.row_factory = sqlite3.Row
-    return con
-
-
 def get_arg_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(
         description='Construt database from downloaded JSON to specified location',
@@ -436,7 +322,7 @@ if __name__ == '__main__':
     parser = get_arg_parser()
     args = parser.parse_args()
 
-    con = setup_sqlite(args.db)
+    con = setup_sqlite(args.db, profile=LOAD)
     with con:
         create_schema(con)
         load_data_from_json(
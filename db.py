@@ -0,0 +1,86 @@
+'''
+Opening the sqlite database shared by the scripts
+
+Kept apart from construct_db_from_json.py, so reading a prepared database
+does not import the schema and loading code.
+'''
+from __future__ import annotations
+
+import sqlite3
+from datetime import timedelta
+from typing import Union
+
+import statements
+
+# Filling a new database, where a crash only means building it again
+LOAD = 'load'
+# Only reading a prepared database
+READ = 'read'
+# Changing a copy in memory, where a change that fails half way is rolled back
+EDIT = 'edit'
+
+PRAGMAS = {
+    LOAD: (
+        'journal_mode = OFF',
+        'synchronous = OFF',
+        'cache_size = -262144',  # 256 MiB
+        'temp_store = MEMORY',
+    ),
+    READ: (
+        'mmap_size = 268435456',  # 256 MiB
+        'cache_size = -65536',  # 64 MiB
+        'query_only = ON',
+    ),
+    EDIT: (
+        'journal_mode = MEMORY',
+        'temp_store = MEMORY',
+    ),
+}
+
+
+def adapt_time(t: timedelta) -> int:
+    return round(t.total_seconds())
+
+
+def convert_time(digits: Union[int, bytes]) -> timedelta:
+    return timedelta(seconds=int(digits))
+
+
+def setup_sqlite(db_location: str, profile: str) -> sqlite3.Connection:
+    '''
+    With `LOAD`, all inserts of `with con:` go into one transaction without journal or sync.
+    With `READ`, the database file is opened read-only and memory-mapped.
+    With `EDIT`, every change is journaled
+    '''
+    sqlite3.register_adapter(timedelta, adapt_time)
+    sqlite3.register_converter('t_time', convert_time)
+    if profile == READ and db_location != ':memory:':
+        from pathlib import Path
+        db_location, uri = f'{Path(db_location).resolve().as_uri()}?mode=ro', True
+    else:
+        uri = False
+    con = sqlite3.connect(
+        db_location, detect_types=sqlite3.PARSE_DECLTYPES, uri=uri,
+        cached_statements=statements.CACHED_STATEMENTS)
+    con.row_factory = sqlite3.Row
+    for pragma in PRAGMAS[profile]:
+        con.execute(f'PRAGMA {pragma}')
+    return con
+
+
+def copy_to_memory(con: sqlite3.Connection) -> sqlite3.Connection:
+    '''
+    Copy of the database in memory with `EDIT`, leaving the database of `con` as is
+    '''
+    memory = setup_sqlite(':memory:', profile=EDIT)
+    con.backup(memory)
+    return memory
+
+
+def tuple_cursor(con: sqlite3.Connection) -> sqlite3.Cursor:
+    '''
+    Cursor returning plain tuples, for scans too big for `sqlite3.Row`
+    '''
+    cur = con.cursor()
+    cur.row_factory = None
+    return cur
@@ -7,18 +7,28 @@ from urllib.request import urlopen
 
 from bs4 import BeautifulSoup
 
+TIMETABLE_LIST_URL =\
+    'https://ods.railway.gov.tw/tra-ods-web/ods/download/dataResource/railway_schedule/JSON/list'
+ROUTE_URL = 'https://ods.railway.gov.tw/tra-ods-web/ods/download/dataResource/f0906cb8dcee4dfd9eb5f8a9a2bd0f5a'
+STATION_URL = 'https://ods.railway.gov.tw/tra-ods-web/ods/download/dataResource/0518b833e8964d53bfea3f7691aea0ee'
 
-def get_timetalbe_download_url(root_url: str) -> str:
+
+def get_timetable_download_urls(root_url: str) -> list[str]:
+    '''
+    URL of every "a" element, in order. The first one is of the nearest service day
+    '''
     with urlopen(root_url) as f:
         html = BeautifulSoup(f, 'html.parser')
-    json_file_html_element = html.a  # First "a" element. Might be wrong
 
     url_parse = urlparse(root_url)
-    json_file_url = urlunsplit(
-        [url_parse.scheme, url_parse.netloc,
-         json_file_html_element['href'], '', '']
-    )
-    return json_file_url
+    return [
+        urlunsplit([url_parse.scheme, url_parse.netloc, element['href'], '', ''])
+        for element in html.find_all('a', href=True)
+    ]
+
+
+def get_timetalbe_download_url(root_url: str) -> str:
+    return get_timetable_download_urls(root_url)[0]  # First "a" element. Might be wrong
 
 
 def _download_and_save(url: str, path_: Path):
@@ -102,15 +112,11 @@ if __name__ == '__main__':
             (station_url, Path(f'{args.output_folder}/{args.station_name}.json'))
         )
     else:
-        timetable_root_url =\
-            'https://ods.railway.gov.tw/tra-ods-web/ods/download/dataResource/railway_schedule/JSON/list'
-        timetable_url = get_timetalbe_download_url(timetable_root_url)
+        timetable_url = get_timetalbe_download_url(TIMETABLE_LIST_URL)
         urls = (
             (timetable_url, Path(f'{args.output_folder}/{args.timetable_name}.json')),
-            ('https://ods.railway.gov.tw/tra-ods-web/ods/download/dataResource/f0906cb8dcee4dfd9eb5f8a9a2bd0f5a',
-             Path(f'{args.output_folder}/{args.route_name}.json')),
-            ('https://ods.railway.gov.tw/tra-ods-web/ods/download/dataResource/0518b833e8964d53bfea3f7691aea0ee',
-             Path(f'{args.output_folder}/{args.station_name}.json'))
+            (ROUTE_URL, Path(f'{args.output_folder}/{args.route_name}.json')),
+            (STATION_URL, Path(f'{args.output_folder}/{args.station_name}.json'))
         )
 
     download_and_save(urls)
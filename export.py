@@ -0,0 +1,175 @@
+'''
+Export diagram data of every route as columnar binary files
+
+One `<route>.cols` file for each route:
+
+    b'TRACOLS1'
+    header length, as little-endian uint64
+    header, as UTF-8 JSON
+    columns, each aligned to 8 bytes
+
+The header holds the strings (station names, train codes, CSS classes)
+and, for every numeric column, its dtype, byte offset, and length,
+so a column can be memory-mapped as is, e.g.
+`numpy.memmap(path, dtype, 'r', offset, (length,))`, or read by `load`.
+
+Segment `i` of `train_index`, `x`, and `y` is `offsets[i]:offsets[i + 1]`.
+'''
+from __future__ import annotations
+
+import json
+import mmap
+import sqlite3
+import sys
+from array import array
+from pathlib import Path
+from typing import TYPE_CHECKING, Union
+
+from db import adapt_time
+from form_svg import decide_network_layouts, type_to_css
+from geometry import RouteGeometry, build_geometries, load_geometries
+
+if TYPE_CHECKING:
+    import argparse
+
+MAGIC = b'TRACOLS1'
+ALIGNMENT = 8
+
+# array typecode -> numpy dtype, both in little-endian
+DTYPES = {'b': '|i1', 'i': '<i4', 'q': '<i8', 'd': '<f8'}
+
+
+def route_columns(geometry: RouteGeometry,
+                  time_lists: dict[tuple[str, str], tuple[tuple[(object, float)]]]
+                  ) -> (dict[str, list[str]], dict[str, array]):
+    codes, classes = [], []
+    train_index, x, y, offsets = array('i'), array('i'), array('d'), array('q', [0])
+    for (code, train_type), _time_lists in time_lists.items():
+        codes.append(code)
+        classes.append(type_to_css.get(train_type, ''))
+        for time_list in _time_lists:
+            train_index.append(len(codes) - 1)
+            x.extend(adapt_time(t) for t, _ in time_list)
+            y.extend(d for _, d in time_list)
+            offsets.append(len(x))
+    strings = {
+        'station_name': list(geometry.names),
+        'train_code': codes,
+        'train_class': classes,
+    }
+    columns = {
+        'station_distance': array('d', geometry.distances),
+        'station_is_active': array('b', geometry.is_active),
+        'train_index': train_index,
+        'offsets': offsets,
+        'x': x,
+        'y': y,
+    }
+    return strings, columns
+
+
+def save(path: Path, route_name: str, strings: dict[str, list[str]], columns: dict[str, array]):
+    layout, position = {}, 0
+    for name, column in columns.items():
+        size = len(column) * column.itemsize
+        layout[name] = {'dtype': DTYPES[column.typecode], 'offset': position, 'length': len(column)}
+        position += size + (-size % ALIGNMENT)
+
+    def encode_header(base: int) -> bytes:
+        header = {
+            'route': route_name,
+            'strings': strings,
+            'columns': {
+                name: {**info, 'offset': info['offset'] + base}
+                for name, info in layout.items()
+            },
+        }
+        return json.dumps(header, ensure_ascii=False).encode('utf-8')
+
+    # Offsets in the header depend on the header length, so measure it first
+    base = len(MAGIC) + 8 + len(encode_header(0))
+    base += -base % ALIGNMENT
+    while True:
+        header = encode_header(base)
+        data_start = len(MAGIC) + 8 + len(header)
+        if data_start <= base:
+            break
+        base = data_start + (-data_start % ALIGNMENT)
+    header += b' ' * (base - data_start)  # JSON allows trailing whitespace
+
+    with path.open('wb') as f:
+        f.write(MAGIC)
+        f.write(len(header).to_bytes(8, 'little'))
+        f.write(header)
+        for column in columns.values():
+            if sys.byteorder == 'big':
+                column = array(column.typecode, column)
+                column.byteswap()
+            data = column.tobytes()
+            f.write(data)
+            f.write(b'\0' * (-len(data) % ALIGNMENT))
+
+
+def load(path: Path) -> (dict, dict[str, memoryview]):
+    '''
+    Header and memory-mapped columns of a `.cols` file. Nothing is copied
+    '''
+    with path.open('rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if mapped[:len(MAGIC)] != MAGIC:
+        raise ValueError(f'{path} is not an exported file')
+    header_length = int.from_bytes(mapped[len(MAGIC):len(MAGIC) + 8], 'little')
+    header = json.loads(mapped[len(MAGIC) + 8:len(MAGIC) + 8 + header_length])
+    typecodes = {dtype: typecode for typecode, dtype in DTYPES.items()}
+    view = memoryview(mapped)
+    columns = {}
+    for name, info in header['columns'].items():
+        typecode = typecodes[info['dtype']]
+        size = info['length'] * array(typecode).itemsize
+        columns[name] = view[info['offset']:info['offset'] + size].cast(typecode)
+    return header, columns
+
+
+def export(con: sqlite3.Connection, output_folder: Path, given_train_codes: Union[None, list[str]] = None,
+           geometries: Union[None, dict[str, RouteGeometry]] = None):
+    if geometries is None:
+        geometries = build_geometries(con)
+    layouts = decide_network_layouts(con, given_train_codes, geometries)
+    for route_name in tuple(layouts):
+        time_lists = layouts.pop(route_name)[-1]
+        strings, columns = route_columns(geometries[route_name], time_lists)
+        save(output_folder / f'{route_name}.cols', route_name, strings, columns)
+
+
+def get_arg_parser() -> argparse.ArgumentParser:
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Export station axis and train segments of every route as columnar binary files',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        '-d',
+        type=str, dest='db', default='db.sqlite',
+        help='Input database file name')
+    parser.add_argument(
+        '-O',
+        default=Path('OUTPUT'), type=Path, dest='output_folder',
+        help='Output folder')
+    parser.add_argument(
+        '-T',
+        default=None, type=str, dest='train_list', nargs='*',
+        help='Only export these trains')
+    return parser
+
+
+if __name__ == '__main__':
+    from db import READ, setup_sqlite
+
+    parser = get_arg_parser()
+    args = parser.parse_args()
+
+    con = setup_sqlite(args.db, profile=READ)
+    with con:
+        export(
+            con, args.output_folder, given_train_codes=args.train_list,
+            geometries=load_geometries(con, args.db))
@@ -1,32 +1,25 @@
 from __future__ import annotations
 
-import argparse
 import sqlite3
 from collections import namedtuple
 from datetime import timedelta
-from itertools import chain, filterfalse, groupby, tee
+from itertools import groupby
 from operator import attrgetter, itemgetter
-from pathlib import Path
-from textwrap import dedent
-from typing import Union
+from typing import TYPE_CHECKING, Generator, Union
 
-from pypika import Order, Parameter, Query, Tables
-from pypika.functions import Count, Max, Min
-from yattag import Doc
+import statements
+from db import LOAD, READ, adapt_time, copy_to_memory, setup_sqlite, tuple_cursor
+from geometry import (ENLARGE_GAP_RATE, PADDING, RouteGeometry,
+                      build_geometries, load_geometries)
 
-from construct_db_from_json import (create_schema, load_data_from_json,
-                                    setup_sqlite)
+if TYPE_CHECKING:
+    import argparse
 
 SECOND_GAP = 0.4
 TEN_MINUTE_GAP = round(60 * 10 * SECOND_GAP)
 HOUR_GAP = round(3600 * SECOND_GAP)
-PADDING = 50
-ENLARGE_GAP_RATE = 10
 FONT_HEIGHT = 12
 
-TIMETABLE, STATION, STATION_NAME_CHT, ROUTE_STATION, TRAIN, ROUTE =\
-    Tables('timetable', 'station', 'station_name_cht', 'route_station', 'train', 'route')
-
 
 def print_(s: str):
     print('\033[K', end='\r')  # clear_previous_print
@@ -72,48 +65,65 @@ active_type = {1: 'station', 0: 'noserv_station'}
 StationLineGroup = namedtuple('HourLineGroup', ['line', 'text'])
 
 
-def form_station_lines(cur: sqlite3.Cursor, width: int) -> list[StationLineGroup]:
-    cur.arraysize = 10  # random number
+def form_station_lines(geometry: RouteGeometry, width: int) -> list[StationLineGroup]:
     result = []
-    stations = cur.fetchmany()
     y_offset = 5  # avoid conflict with hour number
-    while stations:
-        for data in stations:
-            type_ = active_type[data['is_active']]
-            y = round(data['y'] * ENLARGE_GAP_RATE + PADDING)
-            result.append(
-                StationLineGroup(
-                    line=LineInfo(x1=PADDING, x2=width - PADDING, y1=y, y2=y, klass=type_),
-                    text=TextInfo(x=0, y=y - y_offset, klass=type_, text=data["name"])
-                )
+    for name, is_active, y in zip(geometry.names, geometry.is_active, geometry.pixel_ys):
+        type_ = active_type[is_active]
+        result.append(
+            StationLineGroup(
+                line=LineInfo(x1=PADDING, x2=width - PADDING, y1=y, y2=y, klass=type_),
+                text=TextInfo(x=0, y=y - y_offset, klass=type_, text=name)
             )
-        stations = cur.fetchmany()
+        )
     return result
 
 
 def get_time_list(con: sqlite3.Connection,
                   code: str, route_name: str,
                   from_: int, to: int) -> tuple[(str, float)]:
-    cur = con.execute(
-        Query.from_(TIMETABLE)
-        .join(STATION).on(TIMETABLE.station_fk == STATION.pk)
-        .join(ROUTE_STATION).on(STATION.pk == ROUTE_STATION.station_fk)
-        .join(TRAIN).on(TIMETABLE.train_fk == TRAIN.pk)
-        .join(ROUTE).on(ROUTE_STATION.route_fk == ROUTE.pk)
-        .where(
-            (ROUTE.name == Parameter(':name'))
-            & (TRAIN.code == Parameter(':code'))
-            & (TIMETABLE.order_[Parameter(':from'):Parameter(':to')])
-        )
-        .orderby(TIMETABLE.time, order=Order.asc)
-        .select(
-            TIMETABLE.time.as_('x'),
-            ROUTE_STATION.relative_distance.as_('y')
-        ).get_sql(),
+    cur = tuple_cursor(con).execute(
+        statements.select_time_list(),
         {'code': code, 'name': route_name,
          'from': from_, 'to': to}
     )
-    return tuple((r['x'], r['y']) for r in cur.fetchall())
+    return tuple(cur.fetchall())
+
+
+def get_time_lists(con: sqlite3.Connection, route_name: str,
+                   segments: dict[tuple[str, str], tuple[tuple[int, int]]]
+                   ) -> dict[tuple[str, str], tuple[tuple[(timedelta, float)]]]:
+    return {
+        (code, train_type): tuple(get_time_list(con, code, route_name, from_, to) for from_, to in _segments)
+        for (code, train_type), _segments in segments.items()
+    }
+
+
+class LazyTimeLists:
+    '''
+    Time lists of one train, read from the database only while it is drawn
+    '''
+    def __init__(self, con: sqlite3.Connection, code: str, route_name: str, segments: tuple[tuple[int, int]]):
+        self.con, self.code, self.route_name, self.segments = con, code, route_name, segments
+
+    def __len__(self) -> int:
+        return len(self.segments)
+
+    def __iter__(self) -> Generator[tuple[(timedelta, float)]]:
+        for from_, to in self.segments:
+            yield get_time_list(self.con, self.code, self.route_name, from_, to)
+
+
+def read_time_lists(con: sqlite3.Connection, route_name: str,
+                    segments: dict[tuple[str, str], tuple[tuple[int, int]]]
+                    ) -> dict[tuple[str, str], LazyTimeLists]:
+    '''
+    Same as `get_time_lists`, but only one train's points are held at a time
+    '''
+    return {
+        (code, train_type): LazyTimeLists(con, code, route_name, _segments)
+        for (code, train_type), _segments in segments.items()
+    }
 
 
 type_to_css = {
@@ -154,120 +164,221 @@ PathInfo = namedtuple('PathInfo', ['id', 'd', 'klass'])
 TextPathInfo = namedtuple('TextPathInfo', ['offset', 'id', 'klass', 'text'])
 
 
-def form_train_lines(con: sqlite3.Connection, start_hour: int,
-                     segments: dict[tuple[str, str], tuple[tuple[int, int]]],
-                     route_name: str) -> (PathInfo, TextPathInfo):
-    pathes, text_pathes = [], []
+def form_train_lines(code: str, train_type: str, time_list: tuple[(timedelta, float)],
+                     x_offset: timedelta, path_ys: dict[float, str], css: dict[str, str]
+                     ) -> (PathInfo, list[TextPathInfo]):
+    d = ' '.join(
+        f'{round((x - x_offset).total_seconds() * SECOND_GAP + PADDING)},\n'
+        f'{path_ys[y]}'
+        for x, y in time_list
+    )
+    time_span = round(
+        (max(map(itemgetter(0), time_list)).total_seconds()
+         - min(map(itemgetter(0), time_list)).total_seconds())
+        * SECOND_GAP
+    )
+    return (
+        PathInfo(id=code, d=d, klass=css[train_type]),
+        [TextPathInfo(offset=i, id=code, klass=css[train_type], text=code)
+         for i in range(PADDING, time_span - PADDING + 1, min(time_span - 2 * PADDING, 2 * TEN_MINUTE_GAP))]
+    )
+
+
+def iter_train_groups(start_hour: int,
+                      time_lists: dict[tuple[str, str], tuple[tuple[(timedelta, float)]]],
+                      geometry: RouteGeometry, css: dict[str, str] = type_to_css,
+                      max_memory: Union[None, int] = None
+                      ) -> Generator[tuple[str, list[PathInfo], list[TextPathInfo]]]:
+    '''
+    (train code, its pathes, its text pathes), one train code at a time, in the order of code.
+    With `max_memory`, the peak is checked after each train code
+    '''
+    route_name = geometry.name
     x_offset = timedelta(hours=start_hour)
 
     count = 1
-    amount = sum(len(tuple(i for i in s)) for s in segments.values())
+    amount = sum(map(len, time_lists.values()))
     print_(f'{amount} segments to process in "{route_name}"')
 
-    for (code, train_type), _segments in segments.items():
-        for from_, to in _segments:
-            time_list = get_time_list(con, code, route_name, from_, to)
-            d = ' '.join(
-                (dedent(f'''
-                 {round((x - x_offset).total_seconds() * SECOND_GAP + PADDING)},
-                 {y * ENLARGE_GAP_RATE + PADDING}
-                 ''').strip()
-                 for x, y in time_list)
-            )
-            pathes.append(PathInfo(id=code, d=d, klass=type_to_css[train_type]))
-            time_span = round(
-                (max(map(itemgetter(0), time_list)).total_seconds()
-                 - min(map(itemgetter(0), time_list)).total_seconds())
-                * SECOND_GAP
-            )
-            text_pathes.extend(
-                [TextPathInfo(offset=i, id=code, klass=type_to_css[train_type], text=code)
-                 for i in range(PADDING, time_span - PADDING + 1, min(time_span - 2 * PADDING, 2 * TEN_MINUTE_GAP))]
-            )
+    for code, items in groupby(sorted(time_lists.items(), key=lambda x: x[0][0]), key=lambda x: x[0][0]):
+        pathes, text_pathes = [], []
+        for (_, train_type), _time_lists in items:
+            for time_list in _time_lists:
+                path, text_pathes_ = form_train_lines(code, train_type, time_list, x_offset, geometry.path_ys, css)
+                pathes.append(path)
+                text_pathes.extend(text_pathes_)
+                print_(f'{count} / {amount} segments has been processed in "{route_name}"')
+                count += 1
+        check_memory(max_memory, route_name)
+        yield code, pathes, text_pathes
+
 
-            print_(f'{count} / {amount} segments has been processed in "{route_name}"')
-            count += 1
-    return pathes, text_pathes
+def iter_svg(geometry: RouteGeometry,
+             height: int, width: int,
+             start_hour: int, hour_count: int,
+             time_lists: dict[tuple[str, str], tuple[tuple[(timedelta, float)]]],
+             css: dict[str, str] = type_to_css, max_memory: Union[None, int] = None
+             ) -> Generator[str]:
+    '''
+    Same page as `form_svg`, in pieces.
+    Only one train group is formed at a time, and dropped once yielded
+    '''
+    from yattag import Doc
+
+    route_name = geometry.name
+    station_groups = form_station_lines(geometry=geometry, width=width)
+    hour_groups = form_hour_lines(height=height, start_hour=start_hour, hour_count=hour_count)
 
+    doc, tag, text, line = Doc().ttl()
+    doc.asis('<!DOCTYPE html><html>')
+    with tag('head'):
+        doc.stag('meta', charset='utf-8')
+        doc.stag('link', rel='icon', href='data:,')
+        line('title', route_name)
+        doc.stag('link', rel='stylesheet', href='./style.css')  # TODO dynamic location
+    doc.asis('<body>')
+    doc.asis(f'<svg xmlns="http://www.w3.org/2000/svg" width="{width + 2 * PADDING}" height="{height + 2 * PADDING}">')
+    for group in hour_groups:
+        with tag('g', klass='hour'):
+            doc.stag(
+                'line', klass=group.line.klass,
+                x1=group.line.x1, x2=group.line.x2,
+                y1=group.line.y1, y2=group.line.y2,
+            )
+    for group in station_groups:
+        with tag('g', klass='station'):
+            doc.stag(
+                'line', klass=group.line.klass,
+                x1=group.line.x1, x2=group.line.x2,
+                y1=group.line.y1, y2=group.line.y2,
+            )
+    yield doc.getvalue()
+
+    for id_, pathes, text_pathes in iter_train_groups(
+            start_hour=start_hour, time_lists=time_lists, geometry=geometry, css=css, max_memory=max_memory):
+        doc, tag, text, line = Doc().ttl()
+        with tag('g', klass='train'):
+            line('title', id_)
+            for path in pathes:
+                doc.stag('path', id=str(path.id), d=f'M {path.d}', klass=path.klass)
+            for text_path in text_pathes:
+                with tag('text'):
+                    line('textPath', text_path.text, startOffset=text_path.offset,
+                         href=f'#{text_path.id}', klass=text_path.klass)
+        yield doc.getvalue()
 
-def partition(pred, iterable):
-    "Use a predicate to partition entries into false entries and true entries"
-    # partition(is_odd, range(10)) --> 0 2 4 6 8   and  1 3 5 7 9
-    t1, t2 = tee(iterable)
-    return filterfalse(pred, t1), filter(pred, t2)
+    doc, tag, text, line = Doc().ttl()
+    doc.asis('</svg>')
+    # Axes stay in place while scrolling, moved by fixed_header.js
+    with tag(
+        'svg',
+        ('xmlns', 'http://www.w3.org/2000/svg'),
+        ('width', f'{width + 2 * PADDING}'),
+        ('height', f'{PADDING}'),
+        klass='time_axis'
+    ):
+        for group in hour_groups:
+            line('text', group.text.text, x=group.text.x, y=group.text.y, klass=group.text.klass)
+    with tag(
+        'svg',
+        ('xmlns', 'http://www.w3.org/2000/svg'),
+        ('width', f'{PADDING}'),
+        ('height', f'{height + 2 * PADDING}'),
+        klass='station_axis'
+    ):
+        for group in station_groups:
+            line('text', group.text.text, x=group.text.x, y=group.text.y, klass=group.text.klass)
+    with tag('script', src='./fixed_header.js'):
+        pass
+    doc.asis('</body></html>')
+    print_(f'Finish "{route_name}"')
+    yield doc.getvalue()
 
 
-def form_svg(con: sqlite3.Connection, route_name: str,
+def form_svg(geometry: RouteGeometry,
              height: int, width: int,
              start_hour: int, hour_count: int,
-             segments: dict[tuple[str, str], tuple[tuple[int, int]]]
+             time_lists: dict[tuple[str, str], tuple[tuple[(timedelta, float)]]],
+             css: dict[str, str] = type_to_css
              ) -> str:
-    cur = con.execute(
-        Query.from_(STATION)
-        .join(STATION_NAME_CHT).on(STATION.pk == STATION_NAME_CHT.station_fk)
-        .join(ROUTE_STATION).on(STATION.pk == ROUTE_STATION.station_fk)
-        .join(ROUTE).on(ROUTE_STATION.route_fk == ROUTE.pk)
-        .where(ROUTE.name == Parameter('?'))
-        .select(
-            STATION.is_active,
-            STATION_NAME_CHT.name,
-            ROUTE_STATION.relative_distance.as_('y')
-        ).get_sql(),
-        (route_name,)
-    )
-    station_groups = form_station_lines(cur=cur, width=width)
-    hour_groups = form_hour_lines(height=height, start_hour=start_hour, hour_count=hour_count)
-    pathes, text_pathes = form_train_lines(
-        con=con, start_hour=start_hour,
-        segments=segments, route_name=route_name
-    )
+    return ''.join(iter_svg(
+        geometry=geometry,
+        height=height, width=width,
+        start_hour=start_hour, hour_count=hour_count,
+        time_lists=time_lists, css=css))
+
+
+def delta_encode(values: list[int]) -> list[int]:
+    return [b - a for a, b in zip([0] + values, values)]
+
+
+def form_canvas_payload(geometry: RouteGeometry,
+                        height: int, width: int,
+                        start_hour: int, hour_count: int,
+                        time_lists: dict[tuple[str, str], tuple[tuple[(timedelta, float)]]],
+                        css: dict[str, str] = type_to_css, max_memory: Union[None, int] = None
+                        ) -> dict:
+    '''
+    Data for `canvas_renderer.js`.
+    Each segment is a flat list of x seconds from `start_hour` and
+    y pixels from the top line, alternating, both delta-encoded
+    '''
+    x_offset = timedelta(hours=start_hour)
+    stations = [
+        [name, y - PADDING, is_active]
+        for name, y, is_active in zip(geometry.names, geometry.pixel_ys, geometry.is_active)
+    ]
+    trains = []
+    for (code, train_type), _time_lists in time_lists.items():
+        segments = []
+        for time_list in _time_lists:
+            xs = delta_encode([round((x - x_offset).total_seconds()) for x, _ in time_list])
+            ys = delta_encode([round(y * ENLARGE_GAP_RATE) for _, y in time_list])
+            segments.append([v for point in zip(xs, ys) for v in point])
+        trains.append([code, css[train_type], segments])
+        check_memory(max_memory, geometry.name)
+    return {
+        'route': geometry.name,
+        'width': width + 2 * PADDING, 'height': height + 2 * PADDING,
+        'padding': PADDING, 'secondGap': SECOND_GAP,
+        'startHour': start_hour, 'hourCount': hour_count,
+        'stations': stations,
+        'trains': trains,
+    }
 
-    doc, tag, text, line = Doc().ttl()
-    doc.asis('<!DOCTYPE html>')
-    with tag('html'):
-        with tag('head'):
-            doc.stag('meta', charset='utf-8')
-            doc.stag('link', rel='icon', href='data:,')
-            line('title', route_name)
-            doc.stag('link', rel='stylesheet', href='./style.css')  # TODO dynamic location
-        with tag('body'):
-            with tag(
-                'svg',
-                ('xmlns', 'http://www.w3.org/2000/svg'),
-                ('width', f'{width + 2 * PADDING}'),
-                ('height', f'{height + 2 * PADDING}')
-            ):
-                doc.stag('script', href='./fixed_header.js')
-                for group in hour_groups:
-                    with tag('g', klass='hour'):
-                        doc.stag(
-                            'line', klass=group.line.klass,
-                            x1=group.line.x1, x2=group.line.x2,
-                            y1=group.line.y1, y2=group.line.y2,
-                        )
-                        line('text', group.text.text, x=group.text.x, y=group.text.y, klass=group.text.klass)
-                for group in station_groups:
-                    with tag('g', klass='station'):
-                        doc.stag(
-                            'line', klass=group.line.klass,
-                            x1=group.line.x1, x2=group.line.x2,
-                            y1=group.line.y1, y2=group.line.y2,
-                        )
-                        line('text', group.text.text, x=group.text.x, y=group.text.y, klass=group.text.klass)
-                for id_, items in groupby(
-                    sorted(chain(pathes, text_pathes), key=attrgetter('id')),
-                        key=attrgetter('id')):
-                    with tag('g', klass='train'):
-                        line('title', id_)
-                        text_pathes_, pathes_ = partition(lambda x: hasattr(x, 'd'), items)
-                        for path in pathes_:
-                            doc.stag('path', id=str(path.id), d=f'M {path.d}', klass=path.klass)
-                        for text_path in text_pathes_:
-                            with tag('text'):
-                                line('textPath', text_path.text, startOffset=text_path.offset,
-                                     href=f'#{text_path.id}', klass=text_path.klass)
+
+def form_canvas(geometry: RouteGeometry,
+                height: int, width: int,
+                start_hour: int, hour_count: int,
+                time_lists: dict[tuple[str, str], tuple[tuple[(timedelta, float)]]],
+                css: dict[str, str] = type_to_css, max_memory: Union[None, int] = None
+                ) -> str:
+    '''
+    Page drawing the diagram on a canvas from embedded JSON, instead of inline SVG
+    '''
+    import json
+    from html import escape
+
+    route_name = geometry.name
+    payload = form_canvas_payload(
+        geometry=geometry,
+        height=height, width=width,
+        start_hour=start_hour, hour_count=hour_count,
+        time_lists=time_lists, css=css, max_memory=max_memory)
+    data = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).replace('</', '<\\/')
     print_(f'Finish "{route_name}"')
-    return doc.getvalue()
+    return (
+        '<!DOCTYPE html>'
+        '<html><head>'
+        '<meta charset="utf-8">'
+        '<link rel="icon" href="data:,">'
+        f'<title>{escape(route_name)}</title>'
+        '<link rel="stylesheet" href="./style.css">'
+        '</head><body>'
+        f'<script type="application/json" id="diagram">{data}</script>'
+        '<script src="./canvas_renderer.js"></script>'
+        '</body></html>'
+    )
 
 
 def seconds_to_hours(t: int) -> int:
@@ -281,90 +392,12 @@ def get_code_n_train_type(t: Info) -> tuple[str, str]:
     return (t.code, t.train_type)
 
 
-def gen_recursive_cte_statement(given_train_codes: Union[None, list[str]]):
-    # No recursive CTE from pypika yet
-    # Sqlite3 'RETURNING' is not yet supported by either SQLAlchemy or peewee
-    # So we have this workaround
-    statement = [
-        '''
-        WITH RECURSIVE
-            segment (code, train_type, x, y, previous, current, order_, group_) AS (
-                SELECT
-                    train.code ,train_type.code ,_t.time ,route_station.relative_distance
-                    ,_t.previous ,_t.pk ,_t.order_ ,_t.pk
-                FROM timetable AS _t
-                JOIN train ON _t.train_fk = train.pk
-                JOIN train_type ON train.train_type_fk = train_type.pk
-                JOIN station ON _t.station_fk = station.pk
-                JOIN route_station ON station.pk = route_station.station_fk
-                JOIN route ON route_station.route_fk = route.pk
-                WHERE
-                    (
-                        _t.previous ISNULL  -- the very first stop
-                        OR
-                        NOT EXISTS (  -- the previous stop is not on the same route
-                            SELECT NULL FROM timetable AS t
-                            JOIN station AS st ON t.station_fk = st.pk
-                            JOIN route_station AS rs ON st.pk = rs.station_fk
-                            JOIN route AS ro ON rs.route_fk = ro.pk
-                            WHERE ro.name = :route AND t.pk = _t.previous)
-                    )
-                    AND route.name = :route
-        ''',
-        '',
-        '''
-                UNION
-                    SELECT
-                        train.code, train_type.code, timetable.time, route_station.relative_distance,
-                        timetable.previous, timetable.pk, timetable.order_, segment.group_
-                    FROM segment
-                    JOIN timetable ON timetable.previous = segment.current
-                    JOIN train ON timetable.train_fk = train.pk
-                    JOIN train_type ON train.train_type_fk = train_type.pk
-                    JOIN station ON timetable.station_fk = station.pk
-                    JOIN route_station ON station.pk = route_station.station_fk
-                    JOIN route ON route_station.route_fk = route.pk
-                    WHERE
-                        route.name = :route
-            )
-        SELECT
-            code, train_type,
-            MIN(x) AS early, MAX(x) AS late,
-            MIN(order_) AS from_, MAX(order_) AS to_
-        FROM
-            segment
-        GROUP BY
-            segment.code, segment.group_
-        HAVING  -- Travel more than one stop on the route
-            COUNT(segment.current) > 2
-        '''
-    ]
-
-    if given_train_codes:
-        _parameters = ', '.join(f':{i}' for i in range(len(given_train_codes)))
-        statement[1] = f'AND train.code IN ({_parameters})'
-    return ''.join(statement)
-
-
-def decide_layout(con: sqlite3.Connection, route_name: str,
-                  given_train_codes: Union[None, list[str]]) -> (int, int, int, int, tuple[str, str]):
-    parameters = {'route': route_name}
-    cur = con.execute(
-        Query.from_(ROUTE_STATION)
-        .join(ROUTE).on(ROUTE_STATION.route_fk == ROUTE.pk)
-             .where(ROUTE.name == Parameter(':route'))
-             .select(
-            (Max(ROUTE_STATION.relative_distance) - Min(ROUTE_STATION.relative_distance))
-                 .as_('height'),
-        ).get_sql(),
-        parameters)
-    result = cur.fetchone()
-    height = round(result['height'] * ENLARGE_GAP_RATE)
-
-    if given_train_codes:
-        for i, code in zip(range(len(given_train_codes)), given_train_codes):
-            parameters[str(i)] = code
-    cur = con.execute(gen_recursive_cte_statement(given_train_codes), parameters)
+def decide_layout(con: sqlite3.Connection, geometry: RouteGeometry) -> (int, int, int, int, tuple[str, str]):
+    '''
+    Every train on the route. Only some trains (-T) are drawn by `decide_network_layouts`
+    '''
+    height = geometry.height
+    cur = con.execute(statements.select_segments(), {'route': geometry.name})
     infos = tuple(
         Info(early=r['early'], late=r['late'],
              code=r['code'], train_type=r['train_type'],
@@ -376,35 +409,275 @@ def decide_layout(con: sqlite3.Connection, route_name: str,
             sorted(infos, key=get_code_n_train_type),
             key=get_code_n_train_type)
     }
-    start_hour = seconds_to_hours(min(infos, key=attrgetter('early')).early)
-    end_hour = seconds_to_hours(max(infos, key=attrgetter('late')).late) + 1
+    width, start_hour, hour_count = decide_time_span(
+        early=min(infos, key=attrgetter('early')).early,
+        late=max(infos, key=attrgetter('late')).late)
+    return height, width, start_hour, hour_count, segments
+
+
+def decide_time_span(early: int, late: int) -> (int, int, int):
+    start_hour = seconds_to_hours(early)
+    end_hour = seconds_to_hours(late) + 1
     hour_count = end_hour - start_hour + 1
     width = (hour_count - 1) * HOUR_GAP + 2 * PADDING
-    return height, width, start_hour, hour_count, segments
+    return width, start_hour, hour_count
 
 
-def get_route_names(con: sqlite3.Connection, given_train_codes: Union[None, list[str]]) -> tuple[str]:
-    query = (
-        Query.from_(ROUTE)
-        .join(ROUTE_STATION).on(ROUTE.pk == ROUTE_STATION.route_fk)
-        .join(STATION).on(ROUTE_STATION.station_fk == STATION.pk)
-        .join(TIMETABLE).on(STATION.pk == TIMETABLE.station_fk)
-        .where(ROUTE_STATION.relative_distance != 0)  # exclude routes that have only one station
-        .select(ROUTE.name).distinct()
-    )
+# Unpacks and compares as (x, y), so time lists can hold the very same points
+NetworkPoint = namedtuple('NetworkPoint', ['x', 'y'])
+
+
+def scan_trains(con: sqlite3.Connection, given_train_codes: list[str]
+                ) -> Generator[tuple[int, int, int, timedelta, int, str, str]]:
+    '''
+    Same rows as `select_timetable_points`, but only of the given trains.
+    Trains are found by code first, then only their stops are read
+    '''
+    trains = {
+        pk: (code, train_type)
+        for pk, code, train_type in tuple_cursor(con).execute(
+            statements.select_trains_by_code(len(given_train_codes)), tuple(given_train_codes))
+    }
+    if not trains:
+        return
+    cur = tuple_cursor(con).execute(statements.select_stops_of_trains(len(trains)), tuple(trains))
+    for row in cur:
+        yield row + trains[row[4]]
+
+
+def scan_network(con: sqlite3.Connection, given_train_codes: Union[None, list[str]],
+                 route_names: Union[None, set[str]] = None
+                 ) -> dict[str, dict[tuple[str, str], list[tuple[NetworkPoint]]]]:
+    '''
+    Segments of every route, or only of `route_names`, from one pass over the timetable
+
+    Each stop is fanned out to every route its station is on.
+    A segment on a route lasts as long as the following stops stay on the route,
+    same as the recursive CTE from `select_segments`
+    '''
+    station_routes = {}
+    for route_name, station_fk, y in tuple_cursor(con).execute(statements.select_route_station_distances()):
+        if route_names is None or route_name in route_names:
+            station_routes.setdefault(station_fk, []).append((route_name, y))
+
+    routes = {}
+
+    def close(code: str, train_type: str, route_name: str, points: list[NetworkPoint]):
+        if len(points) > 2:  # Travel more than one stop on the route
+            routes.setdefault(route_name, {}).setdefault((code, train_type), []).append(tuple(points))
+
     if given_train_codes:
-        _parameters = ', '.join('?' for _ in range(len(given_train_codes)))
-        query = query.join(TRAIN).on(TIMETABLE.train_fk == TRAIN.pk)\
-            .where(TRAIN.code.isin(Parameter(f'({_parameters})')))\
-            .groupby(TRAIN.code, ROUTE.name)\
-            .having(Count(STATION.pk) > 2)  # travel more than one stop on the route
-        cur = con.execute(query.get_sql(), tuple(given_train_codes))
+        cur = scan_trains(con, given_train_codes)
     else:
-        cur = con.execute(query.get_sql())
+        cur = tuple_cursor(con).execute(statements.select_timetable_points())
+    # pk, previous, station_fk, x, train_pk, code, train_type
+    for (train_pk, code, train_type), rows in groupby(cur, key=itemgetter(4, 5, 6)):
+        opened = {}
+        last_pk = None
+        for pk, previous, station_fk, x, *_ in rows:
+            on_routes = dict(station_routes.get(station_fk, ()))
+            if previous != last_pk:  # not following the previous stop
+                on_routes_ = {}
+            else:
+                on_routes_ = on_routes
+            for route_name in tuple(opened):
+                if route_name not in on_routes_:
+                    close(code, train_type, route_name, opened.pop(route_name))
+            for route_name, y in on_routes.items():
+                opened.setdefault(route_name, []).append(NetworkPoint(x=x, y=y))
+            last_pk = pk
+        for route_name, points in opened.items():
+            close(code, train_type, route_name, points)
+    return routes
+
+
+def decide_network_layouts(con: sqlite3.Connection, given_train_codes: Union[None, list[str]],
+                           geometries: Union[None, dict[str, RouteGeometry]] = None,
+                           hashed: bool = False, route_names: Union[None, set[str]] = None
+                           ) -> dict[str, (int, int, int, int, dict[tuple[str, str], tuple[tuple[(timedelta, float)]]])]:
+    '''
+    Same as `decide_layout` with `get_time_lists` for every route, or only for `route_names`,
+    but scans the timetable only once.
+    With `hashed`, each segment is a `HashedSegment`, to be compared by `diff_segments`
+    '''
+    if geometries is None:
+        geometries = build_geometries(con)
+
+    network = scan_network(con, given_train_codes, route_names)
+    return {
+        route_name: network_layout(network.pop(route_name), geometries[route_name], hashed)
+        for route_name in sorted(network)
+    }
+
+
+def network_layout(segments: dict[tuple[str, str], list[tuple[NetworkPoint]]],
+                   geometry: RouteGeometry, hashed: bool = False
+                   ) -> (int, int, int, int, dict[tuple[str, str], tuple[tuple[(timedelta, float)]]]):
+    '''
+    Layout of one route from its segments of `scan_network`
+    '''
+    time_lists = {
+        key: tuple(tuple(sorted(segment, key=attrgetter('x'))) for segment in _segments)
+        for key, _segments in sorted(segments.items())
+    }
+    width, start_hour, hour_count = decide_time_span(
+        early=adapt_time(min(time_list[0][0] for _time_lists in time_lists.values() for time_list in _time_lists)),
+        late=adapt_time(max(time_list[-1][0] for _time_lists in time_lists.values() for time_list in _time_lists)))
+    if hashed:
+        time_lists = {
+            key: tuple(HashedSegment(hash=hash(time_list), points=time_list) for time_list in _time_lists)
+            for key, _time_lists in time_lists.items()
+        }
+    return geometry.height, width, start_hour, hour_count, time_lists
+
+
+diff_css = {
+    'added': 'added',
+    'removed': 'removed',
+    'shifted': 'shifted',
+    'shifted_from': 'shifted_from',
+}
+
+
+# A segment with its hash computed once, as tuples do not keep their hash
+HashedSegment = namedtuple('HashedSegment', ['hash', 'points'])
+
+
+def diff_segments(old: list[HashedSegment], new: list[HashedSegment]
+                  ) -> dict[str, list[tuple[(timedelta, float)]]]:
+    '''
+    Changed segments of a train, by the kind of change.
+    Segments with the same hash on both days are taken as unchanged;
+    only the rest are compared by their stops
+    '''
+    result = {'added': [], 'removed': [], 'shifted': [], 'shifted_from': []}
+    if [segment.hash for segment in old] == [segment.hash for segment in new]:
+        return result
+    old_hashes = {segment.hash for segment in old}
+    new_hashes = {segment.hash for segment in new}
+    old_left = [segment.points for segment in old if segment.hash not in new_hashes]
+    new_left = [segment.points for segment in new if segment.hash not in old_hashes]
+
+    def stops(segment):
+        return tuple(map(itemgetter(1), segment))
+
+    # Same stops at different times are shifted; anything else is removed or added
+    for new_segment in tuple(new_left):
+        old_segment = next((s for s in old_left if stops(s) == stops(new_segment)), None)
+        if old_segment is not None:
+            old_left.remove(old_segment)
+            new_left.remove(new_segment)
+            result['shifted'].append(new_segment)
+            result['shifted_from'].append(old_segment)
+    result['removed'].extend(old_left)
+    result['added'].extend(new_left)
+    return result
+
+
+def diff_time_lists(old: dict[tuple[str, str], tuple[HashedSegment]],
+                    new: dict[tuple[str, str], tuple[HashedSegment]]
+                    ) -> dict[tuple[str, str], tuple[tuple[(timedelta, float)]]]:
+    '''
+    Changed segments of trains matched by code, keyed by (code, kind of change)
+    '''
+    def by_code(time_lists):
+        result = {}
+        for (code, _), _time_lists in time_lists.items():
+            result.setdefault(code, []).extend(_time_lists)
+        return result
+
+    old_by_code, new_by_code = by_code(old), by_code(new)
+    result = {}
+    for code in sorted(old_by_code.keys() | new_by_code.keys()):
+        changes = diff_segments(old_by_code.get(code, []), new_by_code.get(code, []))
+        for kind, _time_lists in changes.items():
+            if _time_lists:
+                result[(code, kind)] = tuple(_time_lists)
+    return result
+
+
+def decide_diff_layouts(old_con: sqlite3.Connection, new_con: sqlite3.Connection,
+                        given_train_codes: Union[None, list[str]],
+                        old_geometries: Union[None, dict[str, RouteGeometry]] = None,
+                        new_geometries: Union[None, dict[str, RouteGeometry]] = None
+                        ) -> dict[str, (int, int, int, int, dict[tuple[str, str], tuple[tuple[(timedelta, float)]]])]:
+    '''
+    Layouts of routes with changed trains, holding only the changed segments
+    '''
+    old_layouts = decide_network_layouts(old_con, given_train_codes, old_geometries, hashed=True)
+    new_layouts = decide_network_layouts(new_con, given_train_codes, new_geometries, hashed=True)
+    layouts = {}
+    for route_name in sorted(old_layouts.keys() | new_layouts.keys()):
+        old_layout, new_layout = old_layouts.get(route_name), new_layouts.get(route_name)
+        time_lists = diff_time_lists(
+            old_layout[-1] if old_layout else {},
+            new_layout[-1] if new_layout else {})
+        if not time_lists:
+            continue
+        height = (new_layout or old_layout)[0]
+        start_hour = min(layout[2] for layout in (old_layout, new_layout) if layout)
+        end_hour = max(layout[2] + layout[3] - 1 for layout in (old_layout, new_layout) if layout)
+        hour_count = end_hour - start_hour + 1
+        width = (hour_count - 1) * HOUR_GAP + 2 * PADDING
+        layouts[route_name] = (height, width, start_hour, hour_count, time_lists)
+    return layouts
+
+
+def peak_memory() -> int:
+    '''
+    Peak resident memory of this process so far, in MiB
+    '''
+    import resource
+    import sys
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 // (1024 if sys.platform == 'darwin' else 1)  # bytes on macOS, KiB elsewhere
+
+
+def check_memory(max_memory: Union[None, int], route_name: str):
+    '''
+    Raise `MemoryError` once the peak memory is over `max_memory` MiB
+    '''
+    if max_memory and peak_memory() > max_memory:
+        raise MemoryError(f'Peak memory {peak_memory()} MiB is over {max_memory} MiB, while drawing "{route_name}"')
+
+
+def save_route(output_folder: str, file_name: str, geometry: RouteGeometry,
+               layout: (int, int, int, int, dict[tuple[str, str], tuple[tuple[(timedelta, float)]]]),
+               canvas: bool = False, css: dict[str, str] = type_to_css,
+               max_memory: Union[None, int] = None):
+    '''
+    With `max_memory`, a page going over it is not left half written
+    '''
+    from pathlib import Path
+
+    height, width, start_hour, hour_count, time_lists = layout
+    pieces = (form_canvas if canvas else iter_svg)(
+        geometry=geometry,
+        height=height, width=width,
+        start_hour=start_hour, hour_count=hour_count,
+        time_lists=time_lists, css=css, max_memory=max_memory,
+    )
+    if canvas:
+        pieces = (pieces,)
+    path = Path(f'{output_folder}/{file_name}.html')
+    try:
+        with open(path, mode='w') as f:
+            f.writelines(pieces)
+    except MemoryError:
+        path.unlink()
+        raise
+
+
+def get_route_names(con: sqlite3.Connection) -> tuple[str]:
+    cur = con.execute(statements.select_route_names())
     return tuple(r['name'] for r in cur.fetchall())
 
 
 def get_arg_parser() -> argparse.ArgumentParser:
+    import argparse
+    from pathlib import Path
+
     parser = argparse.ArgumentParser(
         description='Form SVG from either downloaded JSON or prepared sqlite database',
         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
@@ -438,17 +711,45 @@ def get_arg_parser() -> argparse.ArgumentParser:
         '-T',
         default=None, type=str, dest='train_list', nargs='*',
         help='Only draw these trains')
+    parser.add_argument(
+        '-N',
+        action='store_true', dest='network',
+        help='Scan the timetable once for all routes, instead of once per route')
+    parser.add_argument(
+        '-C',
+        action='store_true', dest='canvas',
+        help='Embed the diagram as compact JSON drawn on a canvas by canvas_renderer.js, instead of SVG')
+    parser.add_argument(
+        '-D',
+        default=None, type=str, dest='diff_db',
+        help='Prepared database of another service day. '
+             'Only draw trains added, removed, or shifted from it, to "<route>_diff.html"')
+    parser.add_argument(
+        '-M', '--max-memory',
+        default=None, type=int, dest='max_memory',
+        help='Stop with an error once the peak memory goes over this many MiB. Report the peak at the end')
+    parser.add_argument(
+        '-W', '--watch',
+        default=None, type=float, dest='watch', nargs='?', const=1.0,
+        help='After drawing, keep checking the JSON files every this many seconds, '
+             'and draw again only routes of the changed trains')
     return parser
 
 
-if __name__ == '__main__':
+def main(argv: Union[None, list[str]] = None):
+    from pathlib import Path
+
     parser = get_arg_parser()
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     print_('Start to load data')
-    con = setup_sqlite(args.db)
+    need_loading = not Path(args.db).exists()  # connecting would create the file
+    if args.watch and args.diff_db:
+        parser.error('-W cannot be used with -D')
+    con = setup_sqlite(args.db, profile=LOAD if need_loading else READ)
     with con:
-        if not Path(args.db).exists():
+        if need_loading:
+            from construct_db_from_json import create_schema, load_data_from_json
             create_schema(con)
             load_data_from_json(
                 con=con,
@@ -456,19 +757,65 @@ if __name__ == '__main__':
                 station=args.input_folder / f'{args.station_name}.json',
                 timetable=args.input_folder / f'{args.timetable_name}.json',
             )
-        print_('Finish loading data')
-        route_names = get_route_names(con, given_train_codes=args.train_list)
+    print_('Finish loading data')
+    # Only after loading is committed, so the saved geometries match the database file
+    geometries = load_geometries(con, args.db)
+    with con:
+        if args.diff_db:
+            old_con = setup_sqlite(args.diff_db, profile=READ)
+            with old_con:
+                old_geometries = load_geometries(old_con, args.diff_db)
+                layouts = decide_diff_layouts(
+                    old_con, con, given_train_codes=args.train_list,
+                    old_geometries=old_geometries, new_geometries=geometries)
+            geometries = {**old_geometries, **geometries}
+            route_names = tuple(layouts)
+        elif args.network or args.train_list:
+            network = scan_network(con, given_train_codes=args.train_list)
+            route_names = tuple(sorted(network))
+        else:
+            route_names = get_route_names(con)
         print_(f'There are {len(route_names)} routes to process')
-        for i, route in enumerate(route_names, start=1):
-            height, width, start_hour, hour_count, segments =\
-                decide_layout(con, route_name=route, given_train_codes=args.train_list)
-            result = form_svg(
-                con=con, route_name=route,
-                height=height, width=width,
-                start_hour=start_hour, hour_count=hour_count,
-                segments=segments,
-            )
-            with open(f'{args.output_folder}/{route}.html', mode='w') as f:
-                f.write(result)
-            print_(f'{len(route_names) - i} / {len(route_names)} routes to go')
+        try:
+            for i, route in enumerate(route_names, start=1):
+                check_memory(args.max_memory, route)
+                if args.diff_db:
+                    layout = layouts.pop(route)
+                elif args.network or args.train_list:
+                    # Each route is laid out only when drawn, and its segments dropped once it is
+                    layout = network_layout(network.pop(route), geometries[route])
+                else:
+                    height, width, start_hour, hour_count, segments =\
+                        decide_layout(con, geometry=geometries[route])
+                    time_lists = read_time_lists(con, route_name=route, segments=segments)
+                    layout = (height, width, start_hour, hour_count, time_lists)
+                save_route(
+                    args.output_folder, f'{route}_diff' if args.diff_db else route,
+                    geometry=geometries[route], layout=layout, canvas=args.canvas,
+                    css=diff_css if args.diff_db else type_to_css, max_memory=args.max_memory)
+                del layout
+                print_(f'{len(route_names) - i} / {len(route_names)} routes to go')
+        except MemoryError as e:
+            import sys
+            sys.exit(f'\n{e}')
     print_('All done')
+    if args.max_memory:
+        print(f'\nPeak memory {peak_memory()} MiB, within {args.max_memory} MiB')
+    if args.watch:
+        from watch import watch
+        # Changes go to a copy, never to a prepared database file
+        memory = copy_to_memory(con)
+        con.close()
+        watch(
+            memory, output_folder=args.output_folder,
+            json_files=(
+                args.input_folder / f'{args.route_name}.json',
+                args.input_folder / f'{args.station_name}.json',
+                args.input_folder / f'{args.timetable_name}.json',
+            ),
+            geometries=geometries, given_train_codes=args.train_list,
+            canvas=args.canvas, interval=args.watch)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+'''
+Station axis of every route, in distance and in pixels
+
+Built with one query for the whole database, then reused by every render.
+For a database file, it is also saved next to it as `<db>.geometry.json`,
+and read back as long as the database file is not changed.
+'''
+from __future__ import annotations
+
+import os
+import sqlite3
+from collections import namedtuple
+from typing import Union
+
+import statements
+from db import tuple_cursor
+
+PADDING = 50
+ENLARGE_GAP_RATE = 10
+
+RouteGeometry = namedtuple('RouteGeometry', [
+    'name',
+    'distances',  # sorted
+    'names', 'is_active', 'codes',  # of stations, in the same order as `distances`
+    'pixel_ys',  # of station lines
+    'code_to_y',  # station code -> pixel y of its station line
+    'path_ys',  # distance -> y in SVG path data
+    'height',
+])
+
+
+def make_geometry(name: str, stations: list[tuple[float, str, int, str]]) -> RouteGeometry:
+    '''
+    `stations` as (distance, name, is_active, code)
+    '''
+    stations = sorted(stations, key=lambda s: s[0])
+    distances = tuple(s[0] for s in stations)
+    pixel_ys = tuple(round(d * ENLARGE_GAP_RATE + PADDING) for d in distances)
+    return RouteGeometry(
+        name=name,
+        distances=distances,
+        names=tuple(s[1] for s in stations),
+        is_active=tuple(s[2] for s in stations),
+        codes=tuple(s[3] for s in stations),
+        pixel_ys=pixel_ys,
+        code_to_y={s[3]: y for s, y in zip(stations, pixel_ys)},
+        path_ys={d: f'{d * ENLARGE_GAP_RATE + PADDING}' for d in distances},
+        height=round((distances[-1] - distances[0]) * ENLARGE_GAP_RATE) if distances else 0,
+    )
+
+
+def build_geometries(con: sqlite3.Connection) -> dict[str, RouteGeometry]:
+    stations = {}
+    for route_name, distance, name, is_active, code in tuple_cursor(con).execute(
+            statements.select_all_route_stations()):
+        stations.setdefault(route_name, []).append((distance, name, is_active, code))
+    return {
+        route_name: make_geometry(route_name, _stations)
+        for route_name, _stations in stations.items()
+    }
+
+
+def cache_path(db_location: str) -> str:
+    return f'{db_location}.geometry.json'
+
+
+def db_signature(db_location: str) -> list[int]:
+    stat = os.stat(db_location)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def save_geometries(geometries: dict[str, RouteGeometry], db_location: str):
+    import json
+
+    dumped_json = json.dumps({
+        'db': db_signature(db_location),
+        'routes': {
+            route_name: list(zip(g.distances, g.names, g.is_active, g.codes))
+            for route_name, g in geometries.items()
+        },
+    }, ensure_ascii=False)
+    with open(cache_path(db_location), mode='w', encoding='utf-8') as f:
+        f.write(dumped_json)
+
+
+def read_geometries(db_location: str) -> Union[None, dict[str, RouteGeometry]]:
+    import json
+
+    try:
+        with open(cache_path(db_location), encoding='utf-8') as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if cached.get('db') != db_signature(db_location):
+        return None
+    return {
+        route_name: make_geometry(route_name, [tuple(s) for s in stations])
+        for route_name, stations in cached['routes'].items()
+    }
+
+
+def load_geometries(con: sqlite3.Connection, db_location: str) -> dict[str, RouteGeometry]:
+    '''
+    Geometries saved next to the database if still valid, otherwise built and saved
+    '''
+    if db_location == ':memory:':
+        return build_geometries(con)
+    geometries = read_geometries(db_location)
+    if geometries is None:
+        geometries = build_geometries(con)
+        try:
+            save_geometries(geometries, db_location)
+        except OSError:  # e.g. read-only folder. Still usable, just not cached
+            pass
+    return geometries
@@ -0,0 +1,388 @@
+'''
+Golden-output check of the optimized paths against the reference pipeline
+
+`record` builds a database from the fixture JSON and saves, in plain text,
+every table with codes in place of primary keys, and every route as drawn by
+the reference pipeline (`decide_layout` → `get_time_lists` → `form_svg`):
+its size, hour span, station lines, the points of every train path, and,
+for the modes drawing SVG, the train code labels along the paths.
+
+`check` builds the database again, compares its tables, then renders every
+route in every mode in parallel, reads the same things back from the output,
+and prints a diff for each route that is not the same as recorded.
+
+Points are in pixels, so a mode drawing the very same diagram in another way
+(e.g. on a canvas) is compared as is.
+'''
+from __future__ import annotations
+
+import re
+import sqlite3
+import sys
+from contextlib import redirect_stdout
+from html.parser import HTMLParser
+from io import StringIO
+from pathlib import Path
+from typing import TYPE_CHECKING, Union
+
+import statements
+from db import LOAD, READ, adapt_time, setup_sqlite, tuple_cursor
+from form_svg import (PADDING, SECOND_GAP, active_type, decide_layout,
+                      decide_network_layouts, form_canvas, form_hour_lines,
+                      form_svg, get_route_names, get_time_lists)
+from geometry import ENLARGE_GAP_RATE, build_geometries
+
+if TYPE_CHECKING:
+    import argparse
+
+REFERENCE = 'svg'
+MODES = (
+    REFERENCE,
+    'network',  # -N
+    'train_list',  # -T with every train
+    'canvas',  # -C
+    'export',  # export.py
+)
+# Modes drawing SVG, with the train code along each path
+LABELED_MODES = (REFERENCE, 'network', 'train_list')
+
+
+def build_db(db_location: str, input_folder: Path):
+    from construct_db_from_json import create_schema, load_data_from_json
+
+    con = setup_sqlite(db_location, profile=LOAD)
+    with con, redirect_stdout(StringIO()):
+        create_schema(con)
+        load_data_from_json(
+            con=con,
+            route=input_folder / 'route.json',
+            station=input_folder / 'station.json',
+            timetable=input_folder / 'timetable.json')
+    con.close()
+
+
+def canonical_value(value: object) -> str:
+    if value is None:
+        return '-'
+    if hasattr(value, 'total_seconds'):
+        return str(adapt_time(value))
+    return str(value)
+
+
+def dump_db(con: sqlite3.Connection) -> list[str]:
+    lines = []
+    for table, statement in statements.select_canonical_rows():
+        lines.extend(sorted(
+            '\t'.join(map(canonical_value, (table, *row)))
+            for row in tuple_cursor(con).execute(statement)))
+    return lines
+
+
+def pixel(value: float) -> str:
+    '''
+    As is, only without '.0', so whole pixels from every mode read the same
+    '''
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def route_lines(size: tuple[int, int], hours: tuple[str, str],
+                stations: list[tuple[int, str, str]],
+                paths: list[tuple[str, str, list[tuple[float, float]]]],
+                labels: list[tuple[str, str, str, str]] = ()) -> list[str]:
+    '''
+    `stations` as (y, class, name), `paths` as (train code, class, points),
+    `labels` as (text, class, href, startOffset) of the train codes along the paths
+    '''
+    return [
+        f'size\t{size[0]}\t{size[1]}',
+        f'hours\t{hours[0]}\t{hours[1]}',
+        *(f'station\t{y}\t{klass}\t{name}' for y, klass, name in sorted(stations)),
+        *sorted(
+            f'path\t{code}\t{klass}\t' + ' '.join(f'{pixel(x)},{pixel(y)}' for x, y in points)
+            for code, klass, points in paths),
+        *sorted('\t'.join(('label', *label)) for label in labels),
+    ]
+
+
+def without_labels(lines: list[str]) -> list[str]:
+    '''
+    For modes that draw no labels along the paths
+    '''
+    return [line for line in lines if not line.startswith('label\t')]
+
+
+class SVGReader(HTMLParser):
+    '''
+    Size, hour labels, station lines, train paths, and their labels of a page from `form_svg`
+    '''
+    def __init__(self):
+        super().__init__()
+        self.size = None
+        self.axis = None
+        self.hours, self.station_lines, self.station_names, self.paths = [], [], [], []
+        self.labels = []
+        self.in_station = self.in_label = False
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, str]]):
+        attrs = dict(attrs)
+        if tag == 'svg':
+            if self.size is None:
+                self.size = (int(attrs['width']), int(attrs['height']))
+            self.axis = attrs.get('class')
+        elif tag == 'g':
+            self.in_station = attrs.get('class') == 'station'
+        elif tag == 'line' and self.in_station:
+            self.station_lines.append((int(attrs['y1']), attrs['class']))
+        elif tag == 'text' and self.axis == 'time_axis':
+            self.hours.append('')
+        elif tag == 'text' and self.axis == 'station_axis':
+            self.station_names.append('')  # stays empty for stations without a name
+        elif tag == 'path':
+            numbers = attrs['d'].lstrip('M').replace(',', ' ').split()
+            points = [(float(x), float(y)) for x, y in zip(numbers[::2], numbers[1::2])]
+            self.paths.append((attrs['id'], attrs['class'], points))
+        elif tag == 'textpath':  # lowercased by HTMLParser
+            self.labels.append(['', attrs['class'], attrs['href'], attrs['startoffset']])
+            self.in_label = True
+
+    def handle_startendtag(self, tag: str, attrs: list[tuple[str, str]]):
+        self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag: str):
+        if tag == 'svg':
+            self.axis = None
+        elif tag == 'textpath':
+            self.in_label = False
+
+    def handle_data(self, data: str):
+        if self.in_label:
+            self.labels[-1][0] += data
+        elif self.axis == 'time_axis':
+            self.hours[-1] += data
+        elif self.axis == 'station_axis':
+            self.station_names[-1] += data
+
+
+def read_svg(page: str) -> list[str]:
+    reader = SVGReader()
+    reader.feed(page)
+    return route_lines(
+        size=reader.size,
+        hours=(reader.hours[0], reader.hours[-1]),
+        stations=[(y, klass, name) for (y, klass), name in zip(reader.station_lines, reader.station_names)],
+        paths=reader.paths,
+        labels=[tuple(label) for label in reader.labels])
+
+
+def hour_span(height: int, start_hour: int, hour_count: int) -> tuple[str, str]:
+    groups = form_hour_lines(height=height, start_hour=start_hour, hour_count=hour_count)
+    return groups[0].text.text, groups[-1].text.text
+
+
+def read_canvas(page: str) -> list[str]:
+    import json
+
+    payload = json.loads(re.search(
+        r'<script type="application/json" id="diagram">(.*?)</script>', page, re.S).group(1))
+    padding = payload['padding']
+    paths = []
+    for code, klass, segments in payload['trains']:
+        for segment in segments:
+            x, y, points = 0, 0, []
+            for dx, dy in zip(segment[::2], segment[1::2]):
+                x, y = x + dx, y + dy
+                points.append((round(x * payload['secondGap'] + padding), y + padding))
+            paths.append((code, klass, points))
+    return route_lines(
+        size=(payload['width'], payload['height']),
+        hours=hour_span(payload['height'] - 2 * padding, payload['startHour'], payload['hourCount']),
+        stations=[(y + padding, active_type[is_active], name) for name, y, is_active in payload['stations']],
+        paths=paths)
+
+
+def read_columns(strings: dict[str, list[str]], columns: dict[str, object],
+                 height: int, width: int, start_hour: int, hour_count: int) -> list[str]:
+    offsets, x_offset = columns['offsets'], start_hour * 3600
+    paths = [
+        (strings['train_code'][columns['train_index'][i]], strings['train_class'][columns['train_index'][i]],
+         [(round((x - x_offset) * SECOND_GAP + PADDING), y * ENLARGE_GAP_RATE + PADDING)
+          for x, y in zip(columns['x'][offsets[i]:offsets[i + 1]], columns['y'][offsets[i]:offsets[i + 1]])])
+        for i in range(len(offsets) - 1)
+    ]
+    return route_lines(
+        size=(width + 2 * PADDING, height + 2 * PADDING),
+        hours=hour_span(height, start_hour, hour_count),
+        stations=[
+            (round(d * ENLARGE_GAP_RATE + PADDING), active_type[is_active], name)
+            for d, is_active, name in zip(
+                columns['station_distance'], columns['station_is_active'], strings['station_name'])],
+        paths=paths)
+
+
+def render(mode: str, db_location: str) -> dict[str, list[str]]:
+    '''
+    Canonical lines of every route drawn in `mode`
+    '''
+    con = setup_sqlite(db_location, profile=READ)
+    result = {}
+    with con, redirect_stdout(StringIO()):
+        geometries = build_geometries(con)
+        if mode == REFERENCE:
+            layouts = {}
+            for route in get_route_names(con):
+                height, width, start_hour, hour_count, segments =\
+                    decide_layout(con, geometry=geometries[route])
+                time_lists = get_time_lists(con, route_name=route, segments=segments)
+                layouts[route] = (height, width, start_hour, hour_count, time_lists)
+        elif mode == 'train_list':
+            train_codes = [code for code, in tuple_cursor(con).execute(statements.select_train_codes())]
+            layouts = decide_network_layouts(con, given_train_codes=train_codes, geometries=geometries)
+        else:
+            layouts = decide_network_layouts(con, given_train_codes=None, geometries=geometries)
+        for route, (height, width, start_hour, hour_count, time_lists) in layouts.items():
+            if mode == 'export':
+                from export import route_columns
+
+                strings, columns = route_columns(geometries[route], time_lists)
+                result[route] = read_columns(strings, columns, height, width, start_hour, hour_count)
+                continue
+            page = (form_canvas if mode == 'canvas' else form_svg)(
+                geometry=geometries[route],
+                height=height, width=width,
+                start_hour=start_hour, hour_count=hour_count,
+                time_lists=time_lists)
+            result[route] = (read_canvas if mode == 'canvas' else read_svg)(page)
+    con.close()
+    return result
+
+
+def write_lines(path: Path, lines: list[str]):
+    path.write_text(''.join(f'{line}\n' for line in lines), encoding='utf-8')
+
+
+def read_lines(path: Path) -> Union[None, list[str]]:
+    try:
+        return path.read_text(encoding='utf-8').splitlines()
+    except OSError:
+        return None
+
+
+def record(golden_folder: Path, db_location: str):
+    build_db(db_location, golden_folder / 'JSON')
+    con = setup_sqlite(db_location, profile=READ)
+    with con:
+        write_lines(golden_folder / 'db.txt', dump_db(con))
+    con.close()
+    route_folder = golden_folder / 'routes'
+    route_folder.mkdir(exist_ok=True)
+    for old in route_folder.glob('*.txt'):
+        old.unlink()
+    routes = render(REFERENCE, db_location)
+    for route, lines in routes.items():
+        write_lines(route_folder / f'{route}.txt', lines)
+    print(f'Recorded {len(routes)} routes and the database in {golden_folder}')
+
+
+def diff(expected: Union[None, list[str]], actual: Union[None, list[str]],
+         expected_name: str, actual_name: str, context: int) -> list[str]:
+    from difflib import unified_diff
+
+    if expected == actual:
+        return []
+    return list(unified_diff(
+        expected or [], actual or [],
+        fromfile=expected_name if expected is not None else '/dev/null',
+        tofile=actual_name if actual is not None else '/dev/null',
+        n=context, lineterm=''))
+
+
+def check(golden_folder: Path, db_location: str, modes: list[str], jobs: Union[None, int],
+          context: int, limit: int) -> bool:
+    from concurrent.futures import ProcessPoolExecutor
+
+    build_db(db_location, golden_folder / 'JSON')
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {mode: executor.submit(render, mode, db_location) for mode in modes}
+        con = setup_sqlite(db_location, profile=READ)
+        with con:
+            failures = {'db': diff(read_lines(golden_folder / 'db.txt'), dump_db(con), 'db.txt', 'db', context)}
+        con.close()
+        route_folder = golden_folder / 'routes'
+        expected = {path.stem: read_lines(path) for path in route_folder.glob('*.txt')}
+        for mode, future in futures.items():
+            rendered = future.result()
+            for route in sorted(expected.keys() | rendered.keys()):
+                expected_lines = expected.get(route)
+                if mode not in LABELED_MODES and expected_lines is not None:
+                    expected_lines = without_labels(expected_lines)
+                failures[f'{mode} {route}'] = diff(
+                    expected_lines, rendered.get(route),
+                    f'routes/{route}.txt', f'{mode}/{route}', context)
+            differ = sum(1 for route in rendered.keys() | expected.keys()
+                         if failures[f'{mode} {route}'])
+            print(f'{mode}: {len(expected) - differ} / {len(expected)} routes same as recorded'
+                  + (f', {differ} differ' if differ else ''))
+    for name, lines in failures.items():
+        if not lines:
+            continue
+        print(f'\n=== {name}')
+        print('\n'.join(lines[:limit]))
+        if len(lines) > limit:
+            print(f'... {len(lines) - limit} more lines')
+    return not any(failures.values())
+
+
+def get_arg_parser() -> argparse.ArgumentParser:
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Record diagrams of the reference pipeline, or check the optimized paths against them',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        '-G',
+        default=Path('GOLDEN'), type=Path, dest='golden_folder',
+        help='Folder with the fixture JSON in JSON/, and the recorded output')
+    parser.add_argument(
+        '-d',
+        type=str, dest='db', default=None,
+        help='Database file built from the fixture. A temporary file by default')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    subparsers.add_parser('record', help='Record the output of the reference pipeline')
+
+    check_ = subparsers.add_parser('check', help='Compare every mode against the recorded output')
+    check_.add_argument(
+        '-m',
+        default=list(MODES), choices=MODES, dest='modes', nargs='+',
+        help='Modes to compare')
+    check_.add_argument(
+        '-j',
+        default=None, type=int, dest='jobs',
+        help='Modes rendered at once. The number of CPUs by default')
+    check_.add_argument(
+        '-c',
+        default=2, type=int, dest='context',
+        help='Lines of context in each diff')
+    check_.add_argument(
+        '-l',
+        default=40, type=int, dest='limit',
+        help='Lines of diff shown for each route')
+    return parser
+
+
+def main(argv: Union[None, list[str]] = None) -> int:
+    from tempfile import TemporaryDirectory
+
+    args = get_arg_parser().parse_args(argv)
+    with TemporaryDirectory() as folder:
+        db_location = args.db or str(Path(folder) / 'golden.sqlite')
+        if args.db:
+            Path(args.db).unlink(missing_ok=True)
+        if args.command == 'record':
+            record(args.golden_folder, db_location)
+            return 0
+        return 0 if check(args.golden_folder, db_location, args.modes, args.jobs, args.context, args.limit) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,458 @@
+'''
+Download, build, and draw every service day, with the three stages overlapped
+
+Each service day goes through the stages on its own, so a database is built
+while later timetables are still downloading, and the routes of a day are
+drawn as soon as its database is ready. Stages are joined by bounded queues,
+so a fast stage waits for a slow one instead of piling up files.
+
+Downloads run in threads; building and drawing run in worker processes.
+Every timetable is downloaded on each run, as TRA publishes them again day
+after day. Finished stages are saved to a state file after each day, with a
+digest of the timetable and the shared route and station files they came
+from. A later run with the same work folder skips building and drawing a day
+only while that digest is the same, so a run stopped half way goes on from
+where it was, and a changed timetable is built and drawn again.
+
+For trying it out without TRA, `stub` serves JSON files from a folder the
+same way TRA does, and `check` runs the stages against it.
+
+    work folder/
+        route.json, station.json  shared by every day
+        <day>.json                timetable
+        <day>.sqlite
+        state.json
+    output folder/
+        <day>/<route>.html
+        <day>/style.css, fixed_header.js, canvas_renderer.js
+'''
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import sys
+import time
+from collections import namedtuple
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Union
+from urllib.parse import urlparse
+
+if TYPE_CHECKING:
+    import argparse
+    from http.server import ThreadingHTTPServer
+
+STAGES = ('download', 'build', 'render')
+# Linked by every page as './<name>', so each day folder needs its own copy
+ASSETS = ('style.css', 'fixed_header.js', 'canvas_renderer.js')
+ASSET_FOLDER = Path(__file__).parent / 'OUTPUT'
+
+Day = namedtuple('Day', ['name', 'url'])
+Timing = namedtuple('Timing', ['jobs', 'busy', 'first_start', 'last_end'])
+
+
+def day_names(urls: list[str]) -> list[Day]:
+    days = []
+    for i, url in enumerate(urls):
+        name = Path(urlparse(url).path).stem
+        days.append(Day(name=name if name and name not in {d.name for d in days} else f'day{i}', url=url))
+    return days
+
+
+def load_state(path: Path) -> dict[str, dict[str, str]]:
+    '''
+    Day name -> {'digest': of its JSON files, 'stage': the last stage finished with them}
+    '''
+    try:
+        return json.loads(path.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(path: Path, state: dict[str, dict[str, str]]):
+    temporary = path.with_suffix('.tmp')
+    temporary.write_text(json.dumps(state, indent=4, ensure_ascii=False), encoding='utf-8')
+    os.replace(temporary, path)  # never leave a half-written state
+
+
+def file_digest(*paths: Path) -> str:
+    import hashlib
+
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def build_day(route: Path, station: Path, timetable: Path, db_location: Path):
+    from contextlib import redirect_stdout
+    from io import StringIO
+
+    from construct_db_from_json import create_schema, load_data_from_json
+    from db import LOAD, setup_sqlite
+
+    temporary = db_location.with_suffix('.tmp')
+    temporary.unlink(missing_ok=True)
+    con = setup_sqlite(str(temporary), profile=LOAD)
+    with con, redirect_stdout(StringIO()):
+        create_schema(con)
+        load_data_from_json(con=con, route=route, station=station, timetable=timetable)
+    con.close()
+    os.replace(temporary, db_location)
+
+
+def render_day(db_location: Path, output_folder: Path, canvas: bool) -> int:
+    import shutil
+    from contextlib import redirect_stdout
+    from io import StringIO
+
+    from db import READ, setup_sqlite
+    from form_svg import network_layout, save_route, scan_network
+    from geometry import load_geometries
+
+    output_folder.mkdir(parents=True, exist_ok=True)
+    for asset in ASSETS:
+        shutil.copyfile(ASSET_FOLDER / asset, output_folder / asset)
+    con = setup_sqlite(str(db_location), profile=READ)
+    with con, redirect_stdout(StringIO()):
+        geometries = load_geometries(con, str(db_location))
+        network = scan_network(con, given_train_codes=None)
+        route_count = len(network)
+        for route in sorted(network):
+            layout = network_layout(network.pop(route), geometries[route])
+            save_route(str(output_folder), route, geometry=geometries[route], layout=layout, canvas=canvas)
+    con.close()
+    return route_count
+
+
+async def close_after(outbox: asyncio.Queue, workers: int, *producers):
+    '''
+    Once every producer is done, tell each worker of the next stage to stop
+    '''
+    await asyncio.gather(*producers)
+    for _ in range(workers):
+        await outbox.put(None)
+
+
+async def run_stage(stage: str, work: Callable, inbox: asyncio.Queue, outbox: Union[None, asyncio.Queue],
+                    workers: int, timings: dict[str, Timing], state: dict[str, dict[str, str]], state_path: Path,
+                    failed: list[str], done: Callable[[Day, str], bool]):
+    async def worker():
+        while (day := await inbox.get()) is not None:
+            if done(day, stage):
+                print(f'{stage} {day.name} skipped, same timetable as before')
+                if outbox is not None:
+                    await outbox.put(day)
+                continue
+            started = time.perf_counter()
+            try:
+                result = await work(day)
+            except Exception as exc:
+                print(f'{stage} {day.name} failed: {exc!r}')
+                failed.append(day.name)
+                continue
+            ended = time.perf_counter()
+            timing = timings[stage]
+            timings[stage] = Timing(
+                jobs=timing.jobs + 1, busy=timing.busy + ended - started,
+                first_start=min(timing.first_start, started), last_end=max(timing.last_end, ended))
+            # A download of the same timetable keeps what was done with it
+            if STAGES.index(stage) > STAGES.index(state[day.name]['stage']):
+                state[day.name]['stage'] = stage
+            save_state(state_path, state)
+            print(f'{stage} {day.name} in {ended - started:.2f} s' + (f', {result}' if result else ''))
+            if outbox is not None:
+                await outbox.put(day)
+
+    await asyncio.gather(*(worker() for _ in range(workers)))
+
+
+async def run(days: list[Day], route_url: str, station_url: str,
+              work_folder: Path, output_folder: Path,
+              queue_size: int = 2, downloads: int = 3, processes: int = 2, canvas: bool = False) -> bool:
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+    from download_json import _download_and_save
+
+    work_folder.mkdir(parents=True, exist_ok=True)
+    state_path = work_folder / 'state.json'
+    state = load_state(state_path)
+    route, station = work_folder / 'route.json', work_folder / 'station.json'
+    loop = asyncio.get_running_loop()
+    threads, pool = ThreadPoolExecutor(max_workers=downloads), ProcessPoolExecutor(max_workers=processes)
+    timings = {stage: Timing(jobs=0, busy=0.0, first_start=float('inf'), last_end=0.0) for stage in STAGES}
+    failed = []
+
+    def done(day: Day, stage: str) -> bool:
+        '''
+        Whether `stage` of `day` was finished with the JSON files downloaded last, and its file is still there.
+        Downloading is never done, as only the download tells whether a timetable has changed
+        '''
+        if stage == 'download':
+            return False
+        finished = day.name in state and STAGES.index(state[day.name]['stage']) >= STAGES.index(stage)
+        files = {
+            'build': work_folder / f'{day.name}.sqlite',
+            'render': output_folder / day.name,
+        }
+        return finished and files[stage].exists()
+
+    async def download_shared():
+        await asyncio.gather(*(
+            loop.run_in_executor(threads, _download_and_save, url, path)
+            for url, path in ((route_url, route), (station_url, station))))
+
+    async def download(day: Day) -> str:
+        timetable = work_folder / f'{day.name}.json'
+        await loop.run_in_executor(threads, _download_and_save, day.url, timetable)
+        await shared
+        digest = file_digest(route, station, timetable)
+        if state.get(day.name, {}).get('digest') == digest:
+            return 'same timetable'
+        state[day.name] = {'digest': digest, 'stage': 'download'}
+        return 'new timetable'
+
+    async def build(day: Day):
+        await loop.run_in_executor(
+            pool, build_day, route, station, work_folder / f'{day.name}.json', work_folder / f'{day.name}.sqlite')
+
+    async def render(day: Day) -> str:
+        route_count = await loop.run_in_executor(
+            pool, render_day, work_folder / f'{day.name}.sqlite', output_folder / day.name, canvas)
+        return f'{route_count} routes'
+
+    to_download = asyncio.Queue()
+    to_build, to_render = asyncio.Queue(maxsize=queue_size), asyncio.Queue(maxsize=queue_size)
+    for day in days:
+        to_download.put_nowait(day)
+    for _ in range(downloads):
+        to_download.put_nowait(None)
+
+    started = time.perf_counter()
+    common = dict(timings=timings, state=state, state_path=state_path, failed=failed, done=done)
+    with threads, pool:
+        shared = asyncio.ensure_future(download_shared())
+        await asyncio.gather(
+            close_after(
+                to_build, processes,
+                run_stage('download', download, to_download, to_build, downloads, **common)),
+            close_after(
+                to_render, processes,
+                run_stage('build', build, to_build, to_render, processes, **common)),
+            run_stage('render', render, to_render, None, processes, **common),
+        )
+    total = time.perf_counter() - started
+
+    print(f'\n{"stage":<10}{"jobs":>6}{"busy s":>10}{"span s":>10}')
+    for name, timing in timings.items():
+        span = timing.last_end - timing.first_start if timing.jobs else 0
+        print(f'{name:<10}{timing.jobs:>6}{timing.busy:>10.2f}{span:>10.2f}')
+    print(f'{"total":<10}{"":>6}{"":>10}{total:>10.2f}')
+    if failed:
+        print(f'Failed: {", ".join(failed)}. Run again to retry them')
+    return not failed
+
+
+def serve_stub(folder: Path, port: int = 0, day_count: int = 1, latency: float = 0.0) -> ThreadingHTTPServer:
+    '''
+    Serves `folder` like TRA, in a background thread:
+    `/list` links to `/timetable/day1.json` and so on, every day being `timetable.json`,
+    and `/route.json`, `/station.json`. Each response is delayed by `latency` seconds
+    '''
+    import threading
+    from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(SimpleHTTPRequestHandler):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, directory=str(folder), **kwargs)
+
+        def do_GET(self):
+            time.sleep(latency)
+            if self.path == '/list':
+                links = ''.join(f'<a href="/timetable/day{i}.json">day{i}</a>' for i in range(1, day_count + 1))
+                body = f'<html><body>{links}</body></html>'.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+            if self.path.startswith('/timetable/'):
+                self.path = '/timetable.json'
+            super().do_GET()
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def check_with_stub(processes: int) -> bool:
+    '''
+    Run the stages three times against `serve_stub` in a temporary folder:
+    every day is built and drawn, then every day is skipped,
+    then every day is built and drawn again once the timetable has changed
+    '''
+    import shutil
+    import tempfile
+
+    from download_json import get_timetable_download_urls
+
+    with tempfile.TemporaryDirectory() as folder:
+        folder = Path(folder)
+        stub_folder, work_folder, output_folder = folder / 'stub', folder / 'WORK', folder / 'OUTPUT'
+        shutil.copytree(Path(__file__).parent / 'GOLDEN' / 'JSON', stub_folder)
+        server = serve_stub(stub_folder, day_count=2)
+        root = f'http://127.0.0.1:{server.server_address[1]}'
+        days = day_names(get_timetable_download_urls(f'{root}/list'))
+
+        def run_once() -> dict[str, int]:
+            '''
+            Modification time of the database of each day, after running
+            '''
+            ok = asyncio.run(run(
+                days, route_url=f'{root}/route.json', station_url=f'{root}/station.json',
+                work_folder=work_folder, output_folder=output_folder, processes=processes))
+            return {
+                day.name: (work_folder / f'{day.name}.sqlite').stat().st_mtime_ns
+                for day in days if ok and (work_folder / f'{day.name}.sqlite').exists()
+            }
+
+        results = []
+        first = run_once()
+        pages = {
+            day.name: sorted(path.name for path in (output_folder / day.name).glob('*'))
+            for day in days if (output_folder / day.name).exists()
+        }
+        results.append(('every day built and drawn', len(first) == len(days) and all(
+            any(name.endswith('.html') for name in names) and set(ASSETS) <= set(names)
+            for names in pages.values()) and len(pages) == len(days)))
+        second = run_once()
+        results.append(('every day skipped with the same timetable', second == first))
+
+        timetable = stub_folder / 'timetable.json'
+        changed = json.loads(timetable.read_text(encoding='utf-8'))
+        changed['TrainInfos'].pop()
+        timetable.write_text(json.dumps(changed, ensure_ascii=False), encoding='utf-8')
+        third = run_once()
+        results.append(('every day built again with a changed timetable', len(third) == len(days) and all(
+            third[name] != first[name] for name in third)))
+        server.shutdown()
+
+    print()
+    for name, ok in results:
+        print(f'{"ok" if ok else "FAILED"}\t{name}')
+    return all(ok for _, ok in results)
+
+
+def get_arg_parser() -> argparse.ArgumentParser:
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Download, build, and draw every service day, with the stages overlapped',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_ = subparsers.add_parser('run', help='Run the stages', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    run_.add_argument(
+        '-n',
+        default=1, type=int, dest='day_count',
+        help='Number of service days from the timetable list, nearest first')
+    run_.add_argument(
+        '-L',
+        default=None, type=str, dest='list_url',
+        help='Timetable list URL. TRA by default')
+    run_.add_argument(
+        '-R',
+        default=None, type=str, dest='route_url',
+        help='Route information URL. TRA by default')
+    run_.add_argument(
+        '-S',
+        default=None, type=str, dest='station_url',
+        help='Station information URL. TRA by default')
+    run_.add_argument(
+        '-W',
+        default=Path('WORK'), type=Path, dest='work_folder',
+        help='Folder for JSON, databases, and the state file. Run again with the same one to resume')
+    run_.add_argument(
+        '-O',
+        default=Path('OUTPUT'), type=Path, dest='output_folder',
+        help='Output folder. Each day is drawn into a folder of its own')
+    run_.add_argument(
+        '-q',
+        default=2, type=int, dest='queue_size',
+        help='Days waiting between two stages at most')
+    run_.add_argument(
+        '-d',
+        default=3, type=int, dest='downloads',
+        help='Downloads at once')
+    run_.add_argument(
+        '-j',
+        default=2, type=int, dest='processes',
+        help='Worker processes for building and drawing')
+    run_.add_argument(
+        '-C',
+        action='store_true', dest='canvas',
+        help='Draw on a canvas, same as form_svg.py -C')
+
+    stub = subparsers.add_parser(
+        'stub', help='Serve JSON files from a folder in place of TRA',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    stub.add_argument(
+        '-I',
+        default=Path('GOLDEN/JSON'), type=Path, dest='input_folder',
+        help='Folder with route.json, station.json, and timetable.json')
+    stub.add_argument(
+        '-p',
+        default=8000, type=int, dest='port',
+        help='Port')
+    stub.add_argument(
+        '-n',
+        default=3, type=int, dest='day_count',
+        help='Number of service days listed, all with the same timetable')
+    stub.add_argument(
+        '-l',
+        default=0.0, type=float, dest='latency',
+        help='Seconds to wait before each response')
+
+    check = subparsers.add_parser(
+        'check', help='Run the stages against the stub server, twice with the same timetable and once changed',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    check.add_argument(
+        '-j',
+        default=2, type=int, dest='processes',
+        help='Worker processes for building and drawing')
+    return parser
+
+
+def main(argv: Union[None, list[str]] = None) -> int:
+    args = get_arg_parser().parse_args(argv)
+    if args.command == 'stub':
+        server = serve_stub(args.input_folder, args.port, args.day_count, args.latency)
+        root = f'http://127.0.0.1:{server.server_address[1]}'
+        print(f'python pipeline.py run -L {root}/list -R {root}/route.json -S {root}/station.json')
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            server.shutdown()
+        return 0
+    if args.command == 'check':
+        return 0 if check_with_stub(args.processes) else 1
+
+    from download_json import ROUTE_URL, STATION_URL, TIMETABLE_LIST_URL, get_timetable_download_urls
+
+    urls = get_timetable_download_urls(args.list_url or TIMETABLE_LIST_URL)[:args.day_count]
+    ok = asyncio.run(run(
+        day_names(urls),
+        route_url=args.route_url or ROUTE_URL, station_url=args.station_url or STATION_URL,
+        work_folder=args.work_folder, output_folder=args.output_folder,
+        queue_size=args.queue_size, downloads=args.downloads, processes=args.processes,
+        canvas=args.canvas))
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,221 @@
+'''
+In-memory index of where and when trains run
+
+Built once from the route segments `form_svg.scan_network` derives,
+then answers "which trains occupy this section in this time window" and
+"which trains pass this station in this time window" without SQL.
+
+Times are seconds since midnight of the service day, so trains after midnight
+have times over 24:00:00, same as in the database.
+'''
+from __future__ import annotations
+
+import sqlite3
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from operator import attrgetter, itemgetter
+from typing import TYPE_CHECKING, Union
+
+from db import READ, adapt_time, setup_sqlite
+from form_svg import scan_network
+from geometry import RouteGeometry, build_geometries, load_geometries
+
+if TYPE_CHECKING:
+    import argparse
+
+# A straight part of a segment, between two consecutive points
+Leg = namedtuple('Leg', ['t0', 't1', 'y0', 'y1', 'code', 'train_type', 'segment'])
+RouteIndex = namedtuple('RouteIndex', [
+    'starts', 'legs', 'max_duration',
+    'stations',  # station code -> distance
+    'geometry',  # for station names, only to show and to look up
+])
+Occupation = namedtuple('Occupation', ['code', 'train_type', 'enter', 'leave'])
+
+
+def build_route_index(segments: dict[tuple[str, str], list[tuple]], geometry: RouteGeometry) -> RouteIndex:
+    legs = []
+    for (code, train_type), _segments in segments.items():
+        for segment in _segments:
+            points = sorted(((adapt_time(p.x), p.y) for p in segment), key=itemgetter(0))
+            segment_id = points[0][0]
+            legs.extend(
+                Leg(t0=t0, t1=t1, y0=y0, y1=y1, code=code, train_type=train_type, segment=segment_id)
+                for (t0, y0), (t1, y1) in zip(points, points[1:])
+            )
+    legs.sort(key=attrgetter('t0'))
+    return RouteIndex(
+        starts=[leg.t0 for leg in legs],
+        legs=legs,
+        max_duration=max((leg.t1 - leg.t0 for leg in legs), default=0),
+        stations=dict(zip(geometry.codes, geometry.distances)),
+        geometry=geometry,
+    )
+
+
+def build_index(con: sqlite3.Connection, given_train_codes: Union[None, list[str]] = None,
+                geometries: Union[None, dict[str, RouteGeometry]] = None) -> dict[str, RouteIndex]:
+    if geometries is None:
+        geometries = build_geometries(con)
+    index = {}
+    for route_name, segments in scan_network(con, given_train_codes).items():
+        index[route_name] = build_route_index(segments, geometries[route_name])
+    return index
+
+
+def find_station_codes(index: dict[str, RouteIndex], station: str,
+                       route_name: Union[None, str] = None) -> list[str]:
+    '''
+    Codes of stations named `station`, or `station` itself if it is a code,
+    on `route_name` or on any route
+    '''
+    route_indexes = [index[route_name]] if route_name is not None else index.values()
+    codes = set()
+    for route_index in route_indexes:
+        if station in route_index.stations:
+            return [station]
+        geometry = route_index.geometry
+        codes.update(code for code, name in zip(geometry.codes, geometry.names) if name == station)
+    return sorted(codes)
+
+
+def time_in_range(leg: Leg, low: float, high: float) -> Union[None, tuple[float, float]]:
+    '''
+    When the train is between distance `low` and `high` on this leg.
+    A section (`low` < `high`) needs the train to be inside for some distance,
+    so standing at either end station is not in it;
+    a station (`low` == `high`) only needs the train to stand at or pass it
+    '''
+    if leg.y0 == leg.y1:
+        inside = low < leg.y0 < high if low < high else leg.y0 == low
+        return (leg.t0, leg.t1) if inside else None
+    s_low = (low - leg.y0) / (leg.y1 - leg.y0)
+    s_high = (high - leg.y0) / (leg.y1 - leg.y0)
+    s_from, s_to = max(min(s_low, s_high), 0), min(max(s_low, s_high), 1)
+    if s_from > s_to or (low < high and s_from == s_to):
+        return None
+    duration = leg.t1 - leg.t0
+    return (leg.t0 + s_from * duration, leg.t0 + s_to * duration)
+
+
+def find_occupying(route_index: RouteIndex, low: float, high: float,
+                   start: int, end: int) -> list[Occupation]:
+    '''
+    Trains between distance `low` and `high` at some time from `start` to `end`
+    '''
+    low, high = min(low, high), max(low, high)
+    found = {}
+    first = bisect_left(route_index.starts, start - route_index.max_duration)
+    last = bisect_right(route_index.starts, end)
+    for leg in route_index.legs[first:last]:
+        if leg.t1 < start:
+            continue
+        span = time_in_range(leg, low, high)
+        if span is None or span[1] < start or span[0] > end:
+            continue
+        key = (leg.code, leg.train_type, leg.segment)
+        enter, leave = found.get(key, span)
+        found[key] = (min(enter, span[0]), max(leave, span[1]))
+    return sorted(
+        (Occupation(code=code, train_type=train_type, enter=round(enter), leave=round(leave))
+         for (code, train_type, _), (enter, leave) in found.items()),
+        key=attrgetter('enter'))
+
+
+def find_in_section(index: dict[str, RouteIndex], route_name: str,
+                    from_station: str, to_station: str,
+                    start: int, end: int) -> list[Occupation]:
+    '''
+    Trains between stations with code `from_station` and `to_station`
+    on `route_name`, at some time from `start` to `end`
+    '''
+    route_index = index[route_name]
+    return find_occupying(
+        route_index,
+        route_index.stations[from_station], route_index.stations[to_station],
+        start, end)
+
+
+def find_passing(index: dict[str, RouteIndex], station: str,
+                 start: int, end: int) -> list[Occupation]:
+    '''
+    Trains at or through the station with code `station`, on any route, at some time from `start` to `end`
+    '''
+    found = {}
+    for route_index in index.values():
+        if station not in route_index.stations:
+            continue
+        y = route_index.stations[station]
+        for occupation in find_occupying(route_index, y, y, start, end):
+            found.setdefault((occupation.code, occupation.enter), occupation)
+    return sorted(found.values(), key=attrgetter('enter'))
+
+
+def parse_time(s: str) -> int:
+    hour, minute, *second = s.split(':')
+    return int(hour) * 3600 + int(minute) * 60 + int(second[0] if second else 0)
+
+
+def format_time(seconds: int) -> str:
+    return f'{seconds // 3600:0>2d}:{seconds % 3600 // 60:0>2d}:{seconds % 60:0>2d}'
+
+
+def get_arg_parser() -> argparse.ArgumentParser:
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Find trains running in a section or passing a station in a time window',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        '-d',
+        type=str, dest='db', default='db.sqlite',
+        help='Input database file name')
+    parser.add_argument(
+        '-T',
+        default=None, type=str, dest='train_list', nargs='*',
+        help='Only index these trains')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    section = subparsers.add_parser('section', help='Trains between two stations on a route')
+    section.add_argument('route', type=str, help='Route name')
+    section.add_argument('from_station', type=str, help='Station name or code on one end of the section')
+    section.add_argument('to_station', type=str, help='Station name or code on the other end of the section')
+    section.add_argument('start', type=parse_time, help='From, as HH:MM[:SS]')
+    section.add_argument('end', type=parse_time, help='To, as HH:MM[:SS]')
+
+    station = subparsers.add_parser('station', help='Trains stopping at or passing a station')
+    station.add_argument('station', type=str, help='Station name or code')
+    station.add_argument('start', type=parse_time, help='From, as HH:MM[:SS]')
+    station.add_argument('end', type=parse_time, help='To, as HH:MM[:SS]')
+    return parser
+
+
+if __name__ == '__main__':
+    parser = get_arg_parser()
+    args = parser.parse_args()
+
+    con = setup_sqlite(args.db, profile=READ)
+    with con:
+        index = build_index(
+            con, given_train_codes=args.train_list,
+            geometries=load_geometries(con, args.db))
+    def station_code(station: str, route_name: Union[None, str] = None) -> str:
+        codes = find_station_codes(index, station, route_name)
+        if not codes:
+            parser.error(f'No station "{station}"')
+        if len(codes) > 1:
+            parser.error(f'"{station}" is the name of stations {", ".join(codes)}. Give the station code instead')
+        return codes[0]
+
+    if args.command == 'section':
+        if args.route not in index:
+            parser.error(f'No train on route "{args.route}"')
+        result = find_in_section(
+            index, args.route,
+            station_code(args.from_station, args.route), station_code(args.to_station, args.route),
+            args.start, args.end)
+    else:
+        result = find_passing(index, station_code(args.station), args.start, args.end)
+    for occupation in result:
+        print(occupation.code, occupation.train_type,
+              format_time(occupation.enter), format_time(occupation.leave), sep='\t')
@@ -0,0 +1,456 @@
+'''
+All SQL statements used by the scripts
+
+Statements for loading the database are rendered by PyPika once, on first use,
+and the very same string is returned afterwards, so sqlite3's statement cache
+keeps hitting. PyPika is imported inside those builders only.
+Statements for reading a prepared database are written out as is,
+so drawing never imports PyPika.
+Statements with an `IN (...)` list are cached per parameter count.
+'''
+from __future__ import annotations
+
+from functools import cache
+from itertools import chain
+
+CACHED_STATEMENTS = 256  # for sqlite3.connect(cached_statements=...)
+
+
+# construct_db_from_json.py
+
+@cache
+def create_schema() -> str:
+    from pypika import PostgreSQLQuery as Query
+
+    station = Query.create_table('station').columns(
+        ('pk', 'INTEGER PRIMARY KEY AUTOINCREMENT'),
+        ('code', 'TEXT UNIQUE NOT NULL'),
+        ('is_active', 'INTEGER DEFAULT 0 NOT NULL')
+    )
+    station_name_cht = Query.create_table('station_name_cht').columns(
+        ('pk', 'INTEGER PRIMARY KEY AUTOINCREMENT'),
+        ('station_fk', 'REFERENCES station ON DELETE CASCADE'),
+        ('name', 'TEXT NOT NULL')
+    )
+    route = Query.create_table('route').columns(
+        ('pk', 'INTEGER PRIMARY KEY AUTOINCREMENT'),
+        ('name', 'TEXT NOT NULL UNIQUE'),
+    )
+    route_station = Query.create_table('route_station').columns(
+        ('pk', 'INTEGER PRIMARY KEY AUTOINCREMENT'),
+        ('route_fk', 'REFERENCES route ON DELETE CASCADE'),
+        ('station_fk', 'REFERENCES station ON DELETE CASCADE'),
+        ('relative_distance', 'REAL NOT NULL'),
+    )
+    train_type = Query.create_table('train_type').columns(
+        ('pk', 'INTEGER PRIMARY KEY AUTOINCREMENT'),
+        ('code', 'TEXT UNIQUE NOT NULL'),
+    )
+    train_type_name_cht = Query.create_table('train_type_name_cht').columns(
+        ('pk', 'INTEGER PRIMARY KEY AUTOINCREMENT'),
+        ('train_type_fk', 'REFERENCES train_type ON DELETE CASCADE'),
+        ('name', 'TEXT NOT NULL'),
+    )
+    train = Query.create_table('train').columns(
+        ('pk', 'INTEGER PRIMARY KEY AUTOINCREMENT'),
+        ('train_type_fk', 'REFERENCES train_type ON DELETE CASCADE'),
+        ('code', 'TEXT NOT NULL'),
+    )
+    timetable = Query.create_table('timetable').columns(
+        ('pk', 'INTEGER PRIMARY KEY AUTOINCREMENT'),
+        ('station_fk', 'REFERENCES train_type ON DELETE CASCADE'),
+        ('train_fk', 'REFERENCES train ON DELETE CASCADE'),
+        ('previous', 'REFERENCE timetable NULL'),
+        ('time', 't_time NOT NULL'),
+        ('order_', 'INTEGER NOT NULL'),
+    )
+    tables = (
+        station, station_name_cht, route, route_station,
+        train_type, train_type_name_cht, train, timetable,
+    )
+    indexes = (  # No CREATE INDEX from pypika yet
+        'CREATE INDEX "train_code" ON "train" ("code")',
+        'CREATE INDEX "timetable_train_fk" ON "timetable" ("train_fk")',
+    )
+    return ';'.join(chain((t.get_sql() for t in tables), indexes))
+
+
+@cache
+def insert_station_code() -> str:
+    from pypika import Parameter
+    from pypika import PostgreSQLQuery as Query  # Only this supports 'RETURING'
+    return Query.into('station')\
+        .columns('code').insert(Parameter('?'))\
+        .returning('pk').get_sql()
+
+
+@cache
+def insert_station_name() -> str:
+    from pypika import Parameter
+    from pypika import PostgreSQLQuery as Query
+    return Query.into('station_name_cht')\
+        .columns('station_fk', 'name')\
+        .insert(Parameter(':pk'), Parameter(':name')).get_sql()
+
+
+@cache
+def insert_route_name() -> str:
+    from pypika import Parameter
+    from pypika import PostgreSQLQuery as Query
+    return Query.into('route')\
+        .columns('name').insert(Parameter('?'))\
+        .returning('pk').get_sql()
+
+
+@cache
+def select_station_pk() -> str:
+    from pypika import Parameter
+    from pypika import PostgreSQLQuery as Query
+    from pypika import Table
+    station = Table('station')
+    return Query.from_(station)\
+        .select('pk').where(station.code == Parameter('?')).get_sql()
+
+
+@cache
+def update_active_station() -> str:
+    from pypika import Parameter
+    from pypika import PostgreSQLQuery as Query
+    from pypika import Table
+    station = Table('station')
+    return Query.update(station)\
+        .set('is_active', 1)\
+        .where(station.pk == Parameter('?')).get_sql()
+
+
+@cache
+def insert_inactive_station() -> str:
+    from pypika import Parameter
+    from pypika import PostgreSQLQuery as Query
+    return Query.into('station')\
+        .columns('code', 'is_active').insert(Parameter('?'), 0)\
+        .returning('pk').get_sql()
+
+
+@cache
+def insert_route_station() -> str:
+    from pypika import Parameter
+    from pypika import PostgreSQLQuery as Query
+    return Query.into('route_station')\
+        .columns('route_fk', 'station_fk', 'relative_distance')\
+        .insert(Parameter(':route_pk'), Parameter(':station_pk'), Parameter(':distance'))\
+        .get_sql()
+
+
+@cache
+def select_train_type_pk() -> str:
+    from pypika import Parameter
+    from pypika import PostgreSQLQuery as Query
+    from pypika import Table
+    train_type = Table('train_type')
+    return Query.from_(train_type)\
+        .select('pk').where(train_type.code == Parameter('?')).get_sql()
+
+
+@cache
+def insert_train_type() -> str:
+    from pypika import Parameter
+    from pypika import PostgreSQLQuery as Query
+    return Query.into('train_type')\
+        .columns('code').insert(Parameter('?')).returning('pk').get_sql()
+
+
+@cache
+def insert_train_type_name() -> str:
+    from pypika import Parameter
+    from pypika import PostgreSQLQuery as Query
+    return Query.into('train_type_name_cht')\
+        .columns('train_type_fk', 'name')\
+        .insert(Parameter(':train_type_pk'), Parameter(':name')).get_sql()
+
+
+@cache
+def insert_train() -> str:
+    from pypika import Parameter
+    from pypika import PostgreSQLQuery as Query
+    return Query.into('train')\
+        .columns('train_type_fk', 'code')\
+        .insert(Parameter(':train_type_pk'), Parameter(':code'))\
+        .returning('pk').get_sql()
+
+
+@cache
+def insert_timetable() -> str:
+    from pypika import Parameter
+    from pypika import PostgreSQLQuery as Query
+    return Query.into('timetable')\
+        .columns('station_fk', 'train_fk', 'time', 'previous', 'order_')\
+        .insert(Parameter(':station_pk'), Parameter(':train_pk'),
+                Parameter(':time'), Parameter(':previous'), Parameter(':order'))\
+        .returning('pk').get_sql()
+
+
+@cache
+def delete_stops_of_trains(train_code_count: int) -> str:
+    '''
+    Stops of trains in `?, ?, ...`
+    '''
+    from pypika import Parameter, Query, Table
+    timetable, train = Table('timetable'), Table('train')
+    _parameters = ', '.join('?' for _ in range(train_code_count))
+    trains = Query.from_(train).select(train.pk).where(train.code.isin(Parameter(f'({_parameters})')))
+    return Query.from_(timetable).where(timetable.train_fk.isin(trains)).delete().get_sql()
+
+
+@cache
+def delete_trains(train_code_count: int) -> str:
+    from pypika import Parameter, Query, Table
+    train = Table('train')
+    _parameters = ', '.join('?' for _ in range(train_code_count))
+    return Query.from_(train).where(train.code.isin(Parameter(f'({_parameters})'))).delete().get_sql()
+
+
+# form_svg.py
+
+@cache
+def select_time_list() -> str:
+    return '''
+        SELECT timetable.time AS x, route_station.relative_distance AS y
+        FROM timetable
+        JOIN station ON timetable.station_fk = station.pk
+        JOIN route_station ON station.pk = route_station.station_fk
+        JOIN train ON timetable.train_fk = train.pk
+        JOIN route ON route_station.route_fk = route.pk
+        WHERE
+            route.name = :name
+            AND train.code = :code
+            AND timetable.order_ BETWEEN :from AND :to
+        ORDER BY timetable.time ASC
+    '''
+
+
+@cache
+def select_segments() -> str:
+    '''
+    Segments of trains running on route `:route`
+    '''
+    # No recursive CTE from pypika yet
+    # Sqlite3 'RETURNING' is not yet supported by either SQLAlchemy or peewee
+    # So we have this workaround
+    return '''
+        WITH RECURSIVE
+            segment (code, train_type, x, y, previous, current, order_, group_) AS (
+                SELECT
+                    train.code ,train_type.code ,_t.time ,route_station.relative_distance
+                    ,_t.previous ,_t.pk ,_t.order_ ,_t.pk
+                FROM timetable AS _t
+                JOIN train ON _t.train_fk = train.pk
+                JOIN train_type ON train.train_type_fk = train_type.pk
+                JOIN station ON _t.station_fk = station.pk
+                JOIN route_station ON station.pk = route_station.station_fk
+                JOIN route ON route_station.route_fk = route.pk
+                WHERE
+                    (
+                        _t.previous ISNULL  -- the very first stop
+                        OR
+                        NOT EXISTS (  -- the previous stop is not on the same route
+                            SELECT NULL FROM timetable AS t
+                            JOIN station AS st ON t.station_fk = st.pk
+                            JOIN route_station AS rs ON st.pk = rs.station_fk
+                            JOIN route AS ro ON rs.route_fk = ro.pk
+                            WHERE ro.name = :route AND t.pk = _t.previous)
+                    )
+                    AND route.name = :route
+                UNION
+                    SELECT
+                        train.code, train_type.code, timetable.time, route_station.relative_distance,
+                        timetable.previous, timetable.pk, timetable.order_, segment.group_
+                    FROM segment
+                    JOIN timetable ON timetable.previous = segment.current
+                    JOIN train ON timetable.train_fk = train.pk
+                    JOIN train_type ON train.train_type_fk = train_type.pk
+                    JOIN station ON timetable.station_fk = station.pk
+                    JOIN route_station ON station.pk = route_station.station_fk
+                    JOIN route ON route_station.route_fk = route.pk
+                    WHERE
+                        route.name = :route
+            )
+        SELECT
+            code, train_type,
+            MIN(x) AS early, MAX(x) AS late,
+            MIN(order_) AS from_, MAX(order_) AS to_
+        FROM
+            segment
+        GROUP BY
+            segment.code, segment.group_
+        HAVING  -- Travel more than one stop on the route
+            COUNT(segment.current) > 2
+    '''
+
+
+@cache
+def select_route_names() -> str:
+    '''
+    Names of routes with trains on them
+    '''
+    return '''
+        SELECT DISTINCT route.name
+        FROM route
+        JOIN route_station ON route.pk = route_station.route_fk
+        JOIN station ON route_station.station_fk = station.pk
+        JOIN timetable ON station.pk = timetable.station_fk
+        WHERE route_station.relative_distance <> 0  -- exclude routes that have only one station
+    '''
+
+
+@cache
+def select_route_station_distances() -> str:
+    return '''
+        SELECT route.name, route_station.station_fk, route_station.relative_distance AS y
+        FROM route_station
+        JOIN route ON route_station.route_fk = route.pk
+    '''
+
+
+@cache
+def select_timetable_points() -> str:
+    '''
+    Every stop of every train, in the order of `timetable.previous`
+    '''
+    return '''
+        SELECT
+            timetable.pk, timetable.previous, timetable.station_fk, timetable.time AS x,
+            timetable.train_fk AS train_pk, train.code, train_type.code AS train_type
+        FROM timetable
+        JOIN train ON timetable.train_fk = train.pk
+        JOIN train_type ON train.train_type_fk = train_type.pk
+        ORDER BY timetable.train_fk ASC, timetable.pk ASC
+    '''
+
+
+@cache
+def select_trains_by_code(train_code_count: int) -> str:
+    '''
+    Trains in `?, ?, ...`, through the index on `train.code`
+    '''
+    _parameters = ', '.join('?' for _ in range(train_code_count))
+    return f'''
+        SELECT train.pk, train.code, train_type.code AS train_type
+        FROM train
+        JOIN train_type ON train.train_type_fk = train_type.pk
+        WHERE train.code IN ({_parameters})
+    '''
+
+
+@cache
+def select_stops_of_trains(train_count: int) -> str:
+    '''
+    Every stop of trains with pk in `?, ?, ...`, in the order of `timetable.previous`,
+    through the index on `timetable.train_fk`
+    '''
+    _parameters = ', '.join('?' for _ in range(train_count))
+    return f'''
+        SELECT pk, previous, station_fk, time AS x, train_fk
+        FROM timetable
+        WHERE train_fk IN ({_parameters})
+        ORDER BY train_fk ASC, pk ASC
+    '''
+
+
+@cache
+def select_all_route_stations() -> str:
+    return '''
+        SELECT
+            route.name AS route, route_station.relative_distance,
+            station_name_cht.name, station.is_active, station.code
+        FROM station
+        JOIN station_name_cht ON station.pk = station_name_cht.station_fk
+        JOIN route_station ON station.pk = route_station.station_fk
+        JOIN route ON route_station.route_fk = route.pk
+    '''
+
+
+# golden.py
+
+@cache
+def select_train_codes() -> str:
+    return 'SELECT DISTINCT code FROM train'
+
+
+@cache
+def select_canonical_rows() -> tuple[tuple[str, str]]:
+    '''
+    (table, statement) for every table, with foreign keys replaced by codes and names,
+    so rows can be compared between databases built in different ways
+    '''
+    return (
+        ('station', '''
+            SELECT station.code, station.is_active, station_name_cht.name
+            FROM station
+            LEFT JOIN station_name_cht ON station_name_cht.station_fk = station.pk
+        '''),
+        ('route_station', '''
+            SELECT route.name, station.code, route_station.relative_distance
+            FROM route_station
+            JOIN route ON route_station.route_fk = route.pk
+            JOIN station ON route_station.station_fk = station.pk
+        '''),
+        ('train_type', '''
+            SELECT train_type.code, train_type_name_cht.name
+            FROM train_type
+            LEFT JOIN train_type_name_cht ON train_type_name_cht.train_type_fk = train_type.pk
+        '''),
+        ('train', '''
+            SELECT train.code, train_type.code
+            FROM train
+            JOIN train_type ON train.train_type_fk = train_type.pk
+        '''),
+        ('timetable', '''
+            SELECT
+                train.code, timetable.order_, station.code, timetable.time,
+                previous_station.code, previous.time
+            FROM timetable
+            JOIN train ON timetable.train_fk = train.pk
+            JOIN station ON timetable.station_fk = station.pk
+            LEFT JOIN timetable AS previous ON timetable.previous = previous.pk
+            LEFT JOIN station AS previous_station ON previous.station_fk = previous_station.pk
+        '''),
+    )
+
+
+# watch.py
+
+@cache
+def select_routes_of_stations(station_code_count: int) -> str:
+    '''
+    Names of routes with any station in `?, ?, ...`
+    '''
+    _parameters = ', '.join('?' for _ in range(station_code_count))
+    return f'''
+        SELECT DISTINCT route.name
+        FROM route
+        JOIN route_station ON route.pk = route_station.route_fk
+        JOIN station ON route_station.station_fk = station.pk
+        WHERE station.code IN ({_parameters})
+    '''
+
+
+@cache
+def select_station_codes(station_code_count: int) -> str:
+    '''
+    Codes of stations in `?, ?, ...` that are in the database
+    '''
+    _parameters = ', '.join('?' for _ in range(station_code_count))
+    return f'SELECT code FROM station WHERE code IN ({_parameters})'
+
+
+@cache
+def delete_everything() -> tuple[str, ...]:
+    '''
+    One statement per table, to be run one by one in the same transaction as loading again
+    '''
+    tables = (
+        'timetable', 'train', 'train_type_name_cht', 'train_type',
+        'route_station', 'route', 'station_name_cht', 'station',
+    )
+    return tuple(f'DELETE FROM {table}' for table in tables)
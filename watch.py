@@ -0,0 +1,154 @@
+'''
+Keep the database and the station axes in memory, and draw again only what changes
+
+The JSON files are polled for size and modification time. When only the
+timetable changes, trains are compared with the last read by their JSON,
+only the changed trains are replaced in the database, and only routes with
+a station of such a train, before or after the change, are drawn again.
+When the route or station file changes, everything is loaded and drawn again.
+
+The database is a copy in memory with a journal, so a change that fails half
+way is rolled back. Then everything is loaded again instead.
+'''
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import time
+from pathlib import Path
+from typing import Union
+
+import statements
+from construct_db_from_json import CAR_CLASS, delete_trains, fill_in_trains, load_data_from_json
+from form_svg import decide_network_layouts, print_, save_route
+from geometry import RouteGeometry, build_geometries
+
+
+def file_signature(path: Path) -> Union[None, tuple[int, int]]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+def read_trains(timetable: Path) -> dict[str, dict]:
+    with timetable.open() as f:
+        return {train['Train']: train for train in json.load(f)['TrainInfos']}
+
+
+def changed_train_codes(old: dict[str, dict], new: dict[str, dict]) -> list[str]:
+    '''
+    Trains added, removed, or with anything changed
+    '''
+    return sorted(code for code in old.keys() | new.keys() if old.get(code) != new.get(code))
+
+
+def station_codes(trains: list[dict]) -> list[str]:
+    return sorted({info['Station'] for train in trains for info in train['TimeInfos']})
+
+
+def get_routes_of_stations(con: sqlite3.Connection, codes: list[str]) -> set[str]:
+    if not codes:
+        return set()
+    cur = con.execute(statements.select_routes_of_stations(len(codes)), tuple(codes))
+    return {r['name'] for r in cur.fetchall()}
+
+
+def check_trains(con: sqlite3.Connection, trains: list[dict]):
+    '''
+    Raise ValueError for a train that cannot be filled in, before anything is deleted
+    '''
+    unknown_classes = sorted({train['CarClass'] for train in trains} - CAR_CLASS.keys())
+    if unknown_classes:
+        raise ValueError(f'Unknown CarClass {", ".join(unknown_classes)}')
+    codes = station_codes(trains)
+    if codes:
+        cur = con.execute(statements.select_station_codes(len(codes)), tuple(codes))
+        unknown_stations = sorted(set(codes) - {r['code'] for r in cur.fetchall()})
+        if unknown_stations:
+            raise ValueError(f'Unknown Station {", ".join(unknown_stations)}')
+
+
+def replace_trains(con: sqlite3.Connection, codes: list[str], trains: dict[str, dict]):
+    new_trains = [trains[code] for code in codes if code in trains]
+    check_trains(con, new_trains)
+    cur = con.cursor()
+    delete_trains(cur, codes)
+    fill_in_trains(cur, new_trains)
+
+
+def reload(con: sqlite3.Connection, route: Path, station: Path, timetable: Path):
+    '''
+    In the transaction of `con`, so the old data is back if loading fails
+    '''
+    for statement in statements.delete_everything():
+        con.execute(statement)
+    load_data_from_json(con=con, route=route, station=station, timetable=timetable)
+
+
+def draw(con: sqlite3.Connection, output_folder: str, route_names: set[str],
+         geometries: dict[str, RouteGeometry], given_train_codes: Union[None, list[str]], canvas: bool):
+    '''
+    Draw `route_names` again. Routes left without any train lose their file
+    '''
+    layouts = decide_network_layouts(
+        con, given_train_codes=given_train_codes, geometries=geometries, route_names=route_names)
+    for route in sorted(route_names):
+        if route in layouts:
+            save_route(output_folder, route, geometry=geometries[route], layout=layouts[route], canvas=canvas)
+        else:
+            Path(f'{output_folder}/{route}.html').unlink(missing_ok=True)
+
+
+def watch(con: sqlite3.Connection, output_folder: str,
+          json_files: tuple[Path, Path, Path], geometries: dict[str, RouteGeometry],
+          given_train_codes: Union[None, list[str]] = None, canvas: bool = False,
+          interval: float = 1.0):
+    '''
+    `json_files` as (route, station, timetable). Runs until interrupted
+    '''
+    route, station, timetable = json_files
+    signatures = tuple(map(file_signature, json_files))
+    trains = read_trains(timetable)
+    out_of_date = False  # the last change was skipped, so only loading everything catches up
+    print(f'Watching {", ".join(map(str, json_files))}. Press Ctrl-C to stop')
+    try:
+        while True:
+            time.sleep(interval)
+            current = tuple(map(file_signature, json_files))
+            if current == signatures:
+                continue
+            time.sleep(interval)  # let the file be written completely
+            if tuple(map(file_signature, json_files)) != current:
+                continue
+            started = time.perf_counter()
+            try:
+                new_trains = read_trains(timetable)
+                route_names = None
+                if current[:2] == signatures[:2] and not out_of_date:
+                    codes = changed_train_codes(trains, new_trains)
+                    changed = [t[c] for t in (trains, new_trains) for c in codes if c in t]
+                    try:
+                        with con:
+                            replace_trains(con, codes, new_trains)
+                        route_names = get_routes_of_stations(con, station_codes(changed))
+                    except (ValueError, KeyError, TypeError, sqlite3.Error) as e:
+                        print(f'Load everything again, as changing trains failed: {e!r}')
+                if route_names is None:
+                    with con:
+                        reload(con, route=route, station=station, timetable=timetable)
+                    new_geometries = build_geometries(con)
+                    route_names = set(geometries) | set(new_geometries)
+                    geometries = new_geometries
+            except (OSError, ValueError, KeyError, TypeError, sqlite3.Error) as e:  # e.g. still being written
+                print(f'Skip this change: {e!r}')
+                signatures, out_of_date = current, True
+                continue
+            signatures, trains, out_of_date = current, new_trains, False
+            draw(con, output_folder, route_names, geometries, given_train_codes, canvas)
+            print_(f'Drew {len(route_names)} routes again in {time.perf_counter() - started:.2f} s')
+            print()
+    except KeyboardInterrupt:
+        pass